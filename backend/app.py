@@ -1,75 +1,213 @@
-from flask import Flask, request, jsonify, session
-import sandbox              # Sandbox code 
+from flask import Flask, request, jsonify, session, send_file
 import uuid                 # For unique session keys
+import hmac                 # Constant time admin token check
+import re                   # Validates output ids
 import os 
 from dotenv import load_dotenv
 
-load_dotenv()
+load_dotenv()               # Before importing sandbox, which reads its settings from the environment
+import sandbox              # Sandbox code 
+import jobs                 # Background executions
+
+sandbox.start_background()  # Registry sync, reaper and warm pool, only the server runs them
+
 app = Flask(__name__)
 app.secret_key = os.environ.get("FLASK_SECRET_KEY")
+job_store = jobs.JobStore(sandbox.service, sandbox.container_manager.store, ttl=int(os.environ.get("JOB_TTL", "600")))
+
+# 429 response for requests that were turned away because the server is at capacity
+def busy_response(result):
+    response = jsonify(result)
+    response.headers["Retry-After"] = str(result["retry_after"])
+    return response, 429
+
+# Clients skip the result cache with "Cache-Control: no-cache", e.g. for scripts that use randomness
+def use_result_cache():
+    return "no-cache" not in request.headers.get("Cache-Control", "")
+
+# 429 response if the user used up their request budget, None otherwise
+def rate_limited(user_id, cost=1):
+    retry_after = sandbox.rate_limiter.take(user_id, cost)
+    if retry_after:
+        return busy_response({"status": "error", "message": "Too many requests", "retry_after": retry_after})
+    return None
+
+# 403 response unless the X-Admin-Token header matches ADMIN_TOKEN, None otherwise.
+# Without ADMIN_TOKEN the admin endpoints are disabled.
+def admin_forbidden():
+    admin_token = os.environ.get("ADMIN_TOKEN")
+    if not admin_token or not hmac.compare_digest(request.headers.get("X-Admin-Token", ""), admin_token):
+        return jsonify({"status": "error", "message": "Forbidden"}), 403
+    return None
 
 '''
 Creates session and starts sandbox for user
     is called from svelte post request: 
     in startup function in script (+page_svelte)
+    returns the id of the image the sandbox runs
 '''
 @app.route('/api/startup', methods=['POST'])
 def create_session():
     data = request.json or {}
     tag = data.get('tag', 'nightly')
-    if tag not in ('latest', 'nightly', 'experimental'):
+    if tag not in sandbox.IMAGE_TAGS:
         return jsonify({"status": "error", "message": "Invalid tag"}), 400
 
     if "user_id" not in session:
         session["user_id"] = str(uuid.uuid4())
-    if sandbox.start_sandbox(session["user_id"], tag):
+    try:
+        container = sandbox.service.run(sandbox.start_sandbox, session["user_id"], tag)
+    except sandbox.QueueBusy as e:
+        return busy_response({"status": "error", "message": str(e), "retry_after": e.retry_after})
+    if container:
         print(f"Created new sandbox for user {session['user_id']} with tag {tag}")
-        return jsonify({"status": "success", "message": "Succeeded in launching container"}), 200
+        # The frontend only shows precomputed example output that was made with the same image
+        try:
+            image = sandbox.image_digest(tag)
+        except Exception:
+            image = None
+        return jsonify({"status": "success", "message": "Succeeded in launching container", "image": image}), 200
     return jsonify({"status": "error", "message": "Failed to launch sandbox"}), 400
 
 '''
 Lints the provided code using Ruff
     is called from svelte post request:
     lintCode function in +page.svelte
+    returns {"status": "success", "diagnostics": [{code, message, line, column, end_line, end_column}]},
+    or {"status": "superseded"} when a newer lint request of the same session replaced this one
 '''
 @app.route('/api/lint', methods=['POST'])
 def lint_code():
     code = request.json.get("code")
     if not code:
-        return jsonify({"error": "No code provided"}), 400
+        return jsonify({"status": "error", "message": "No code provided"}), 400
 
     if "user_id" not in session:
         return jsonify({"status": "error", "message": "No active session"}), 400
+    if (limited := rate_limited(session["user_id"], sandbox.LINT_REQUEST_COST)):
+        return limited
 
     try:
-        # Use the sandbox container to lint the code
+        # ruff runs on the host, the sandbox is not involved
         result = sandbox.lint_code(session["user_id"], code)
-        if result["status"] == "success":
-            return jsonify({"lint": result["lint_output"]})
-        else:
-            return jsonify({"error": result["message"]})
+        return jsonify(result), 200
 
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return jsonify({"status": "error", "message": str(e)}), 500
 
 '''
 Does arbitrary code execution in user sandbox
     is called fron svelte post request: 
     executeCode function in +page.svelte 
     (which intern is called by pressing the execute button)
+    the request may also carry the tabs, which are uploaded together with the code
 '''
 @app.route('/api/execute', methods=['POST'])
 def execute_code():
     # Svelte doesn't sent {"code" : "<python code>"} but {"<python code>"}, but doesn't matter.
     data = request.json
     code = data.get('code', '')
+    tabs = data.get('tabs')
 
     if "user_id" not in session:
         return jsonify({"status": "error", "message": "No active session"}), 400
+    if (limited := rate_limited(session["user_id"])):
+        return limited
     
-    result = sandbox.execute_code(session["user_id"], code)
+    result = sandbox.execute_code(session["user_id"], code, tabs, use_result_cache())
+    if "retry_after" in result:
+        return busy_response(result)
     return jsonify(result), 200
 
+'''
+Starts code execution in the user sandbox in the background
+    returns a job id right away, the output and the result are polled with GET /api/jobs/<job_id>
+'''
+@app.route('/api/jobs', methods=['POST'])
+def create_job():
+    data = request.json or {}
+    code = data.get('code', '')
+    tabs = data.get('tabs')
+
+    if "user_id" not in session:
+        return jsonify({"status": "error", "message": "No active session"}), 400
+    if (limited := rate_limited(session["user_id"])):
+        return limited
+
+    # Turn the job away right away if it could not even wait for an execution slot
+    slots = sandbox.service.on_loop(sandbox.execution_slots.metrics)
+    if sandbox.service.on_loop(sandbox.execution_slots.full):
+        return busy_response({"status": "error", "message": "Server is busy", "retry_after": slots["retry_after"]})
+
+    # Executions of all worker processes count, the slots are shared through the registry
+    running = sandbox.container_manager.store.running_executions()
+    queue_position = slots["waiting"] + 1 if running >= slots["limit"] else 0
+    job_id = job_store.submit(session["user_id"], sandbox.execute_code_async, session["user_id"], code, tabs,
+                           use_result_cache())
+    return jsonify({"status": "success", "job_id": job_id, "queued": queue_position > 0,
+                    "queue_position": queue_position}), 202
+
+'''
+Returns the state and (when done) the result of an execution job
+    with ?since=N also the events (output, state changes) after the first N ones and the
+    cursor for the next poll as "next". It answers right away, so polling holds no
+    request thread while the code runs. Jobs live in the shared registry, so any worker can answer.
+'''
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    if "user_id" not in session:
+        return jsonify({"status": "error", "message": "No active session"}), 400
+
+    job = job_store.poll(job_id, session["user_id"], request.args.get("since", type=int))
+    if job is None:
+        return jsonify({"status": "error", "message": "Job not found"}), 404
+    return jsonify({"status": "success", **job}), 200
+
+'''
+Downloads the full output of an execution whose output was too large to return inline
+    the execution result carries its output_id, only the user that ran it can fetch it
+'''
+@app.route('/api/outputs/<output_id>', methods=['GET'])
+def download_output(output_id):
+    if "user_id" not in session:
+        return jsonify({"status": "error", "message": "No active session"}), 400
+    if not re.fullmatch(r"[0-9a-f]{32}", output_id):
+        return jsonify({"status": "error", "message": "Output not found"}), 404
+
+    path = sandbox.output_path(session["user_id"], output_id)
+    if not os.path.exists(path):
+        return jsonify({"status": "error", "message": "Output not found"}), 404
+    return send_file(path, mimetype="text/plain", as_attachment=True, download_name="output.txt")
+
+'''
+Serves an artifact (visualization or image) listed in the manifest of an execution result
+    artifacts are named by their content hash and never change, so the hash is their ETag
+    and browsers may keep them. Images are sent as they are, without base64 encoding.
+    HTML and SVG are sandboxed by the CSP header as well, also when the URL is opened directly
+'''
+@app.route('/api/artifacts/<artifact_id>', methods=['GET'])
+def get_artifact(artifact_id):
+    if "user_id" not in session:
+        return jsonify({"status": "error", "message": "No active session"}), 400
+    match = re.fullmatch(r"([0-9a-f]{64})\.([a-z]+)", artifact_id)
+    mimetypes = {extension: mime for mime, extension in sandbox.ARTIFACT_EXTENSIONS.items()}
+    if match is None or match.group(2) not in mimetypes:
+        return jsonify({"status": "error", "message": "Artifact not found"}), 404
+
+    path = sandbox.artifact_path(artifact_id)
+    if not os.path.exists(path):
+        return jsonify({"status": "error", "message": "Artifact not found"}), 404
+    # conditional: answers 304 Not Modified if the browser sends the ETag back
+    response = send_file(path, mimetype=mimetypes[match.group(2)], etag=match.group(1),
+                         conditional=True, max_age=sandbox.ARTIFACT_TTL)
+    response.cache_control.immutable = True
+    response.headers["X-Content-Type-Options"] = "nosniff"
+    if match.group(2) == "html":
+        response.headers["Content-Security-Policy"] = "sandbox allow-scripts"
+    elif match.group(2) == "svg":
+        response.headers["Content-Security-Policy"] = "sandbox"
+    return response
+
 '''
 Stops sandbox for user session
     called from svelte post request:
@@ -77,7 +215,7 @@ Stops sandbox for user session
 @app.route('/api/stop', methods=['POST'])
 def stop_sandbox():
     if "user_id" in session:
-        sandbox.stop_sandbox(session["user_id"])
+        sandbox.service.run(sandbox.stop_sandbox, session["user_id"])
         session.pop("user_id", None) 
         return jsonify({"status": "success", "message": "Sandbox stopped"})
     return jsonify({"status": "error", "message": "No active session"}), 400
@@ -96,11 +234,32 @@ def save_tabs():
         return jsonify({"status": "error", "message": "No tabs provided"}), 400
 
     try:
-        result = sandbox.save_tabs(session["user_id"], tabs)
+        result = sandbox.service.run(sandbox.save_tabs, session["user_id"], tabs)
         return jsonify(result), 200
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
+'''
+Reports sandbox pool sizes and counters
+    used for monitoring, not called from the frontend
+    requires the X-Admin-Token header to match ADMIN_TOKEN, disabled when that is not set
+'''
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    if (forbidden := admin_forbidden()):
+        return forbidden
+    return jsonify({**sandbox.metrics(), "jobs": job_store.metrics()}), 200
+
+'''
+Reports the scheduler limits and current queue depths
+    requires the X-Admin-Token header to match ADMIN_TOKEN, disabled when that is not set
+'''
+@app.route('/api/admin/scheduler', methods=['GET'])
+def scheduler_status():
+    if (forbidden := admin_forbidden()):
+        return forbidden
+    return jsonify({"status": "success", **sandbox.scheduler_status()}), 200
+
 # Only used for development, deployment uses gunicorn which ignores this
 if __name__ == '__main__':
     app.run(debug=True, host='127.0.0.1', port=5000)
@@ -0,0 +1,124 @@
+# Load benchmark for a running playground backend
+#
+# Simulates users that each start a sandbox and run code a number of times, and reports
+# executions and HTTP requests per second. Meanwhile a probe lints every probe interval, the
+# lint latency shows whether short requests still get a thread while executions run.
+#
+# Before and after: run the baseline (only /api/execute exists there) and the current backend
+# with the same gunicorn settings, e.g. "gunicorn --threads 4 --bind 127.0.0.1:5000 app:app":
+#   git worktree add ../baseline <baseline commit>      (and start the backend from ../baseline/backend)
+#   python3 benchmarks/load_benchmark.py --mode execute
+# then against the current backend
+#   python3 benchmarks/load_benchmark.py --mode jobs
+# Needs a Docker host with the sandbox images, no numbers are checked in.
+import argparse
+import json
+import statistics
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.cookiejar import CookieJar
+
+CODE = "import time\ntime.sleep(1)\nprint('done')"
+
+class User:
+    """One browser session with its own cookie jar"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(CookieJar()))
+        self.requests = 0
+
+    def request(self, method, path, data=None):
+        self.requests += 1
+        body = json.dumps(data).encode() if data is not None else None
+        request = urllib.request.Request(
+            self.base_url + path, data=body, method=method, headers={"Content-Type": "application/json"}
+        )
+        with self.opener.open(request, timeout=120) as response:
+            return json.loads(response.read())
+
+    def execute(self, mode):
+        if mode == "execute":
+            return self.request("POST", "/api/execute", {"code": CODE})
+        job = self.request("POST", "/api/jobs", {"code": CODE})
+        if job.get("status") != "success":
+            return job
+        since = 0
+        while True:
+            time.sleep(0.25)    # the poll interval of the playground
+            state = self.request("GET", f"/api/jobs/{job['job_id']}?since={since}")
+            since = state["next"]
+            if state["state"] == "done":
+                return state["result"]
+
+def run_user(base_url, mode, executions, tag):
+    user = User(base_url)
+    user.request("POST", "/api/startup", {"tag": tag})
+    latencies, failures = [], 0
+    try:
+        for _ in range(executions):
+            start = time.perf_counter()
+            result = user.execute(mode)
+            latencies.append(time.perf_counter() - start)
+            failures += result.get("status") != "success"
+    finally:
+        user.request("POST", "/api/stop", {})
+    return latencies, failures, user.requests
+
+# Lints every interval until stopped, returns the latencies (None for failed requests)
+def probe_lint(base_url, interval, stopped, tag):
+    user = User(base_url)
+    user.request("POST", "/api/startup", {"tag": tag})
+    latencies = []
+    try:
+        while not stopped.wait(interval):
+            start = time.perf_counter()
+            try:
+                user.request("POST", "/api/lint", {"code": "import os\n"})
+                latencies.append(time.perf_counter() - start)
+            except Exception:
+                latencies.append(None)
+    finally:
+        user.request("POST", "/api/stop", {})
+    return latencies
+
+def describe(latencies):
+    latencies = sorted(latencies)
+    return (f"median {statistics.median(latencies):.2f}s, "
+            f"p95 {latencies[int(0.95 * (len(latencies) - 1))]:.2f}s, max {latencies[-1]:.2f}s")
+
+def main():
+    parser = argparse.ArgumentParser(description="Load benchmark for a running playground backend")
+    parser.add_argument("--url", default="http://127.0.0.1:5000")
+    parser.add_argument("--mode", choices=("execute", "jobs"), default="jobs")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--executions", type=int, default=5, help="executions per user")
+    parser.add_argument("--tag", default="nightly")
+    parser.add_argument("--probe-interval", type=float, default=0.5, help="seconds between probe lints")
+    args = parser.parse_args()
+
+    stopped = threading.Event()
+    with ThreadPoolExecutor(max_workers=args.users + 1) as executor:
+        probe = executor.submit(probe_lint, args.url, args.probe_interval, stopped, args.tag)
+        start = time.perf_counter()
+        results = list(executor.map(
+            lambda _: run_user(args.url, args.mode, args.executions, args.tag), range(args.users)
+        ))
+        elapsed = time.perf_counter() - start
+        stopped.set()
+        probes = probe.result()
+
+    latencies = [latency for user_latencies, _, _ in results for latency in user_latencies]
+    failures = sum(user_failures for _, user_failures, _ in results)
+    requests = sum(user_requests for _, _, user_requests in results)
+    print(f"mode={args.mode} users={args.users} executions={len(latencies)} failures={failures}")
+    print(f"throughput: {len(latencies) / elapsed:.2f} executions/s, {requests / elapsed:.2f} requests/s over {elapsed:.1f}s")
+    print(f"execution latency: {describe(latencies)}")
+    answered = [latency for latency in probes if latency is not None]
+    if answered:
+        print(f"lint latency under load: {describe(answered)}, {len(probes) - len(answered)} failed")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+import asyncio
+import logging
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+class JobStore:
+    """Runs jobs as coroutines on the sandbox service so request handlers return immediately.
+
+    State, result and events of the jobs live in the shared registry (see registry.py), so a
+    job runs in the worker process that accepted it and can be polled through any worker.
+    Output is buffered and written every flush_interval seconds instead of per chunk.
+    """
+
+    def __init__(self, service, store, ttl=600, flush_interval=0.2):
+        self.service = service
+        self.store = store
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+
+    def submit(self, user_id, function, *args):
+        """Queue the coroutine function(*args, on_output=...) for user_id and return the job id,
+        its return value becomes the job result. Text passed to on_output is published as output events."""
+        self.store.expire_jobs(time.time() - self.ttl)
+        job_id = uuid.uuid4().hex
+        self.store.create_job(job_id, user_id)
+        self.service.submit(self._run(job_id, function, args))
+        return job_id
+
+    async def _run(self, job_id, function, args):
+        output = []
+        output_lock = threading.Lock()
+        finished = asyncio.Event()
+
+        def on_output(text):
+            with output_lock:
+                output.append(("output", {"text": text}))
+
+        def take_output():
+            with output_lock:
+                events = output[:]
+                output.clear()
+            return events
+
+        async def flush_output():
+            while not finished.is_set():
+                try:
+                    await asyncio.wait_for(finished.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+                events = take_output()
+                if events and not finished.is_set():
+                    await self.service.blocking(self.store.add_job_events, job_id, events)
+                elif events:
+                    # Put back for the final write, which has to come after this one
+                    with output_lock:
+                        output[:0] = events
+
+        await self.service.blocking(self.store.add_job_events, job_id, [("state", {"state": "running"})], "running")
+        flusher = asyncio.ensure_future(flush_output())
+        try:
+            result = await function(*args, on_output=on_output)
+        except Exception as e:
+            logger.error(f"Job {job_id} failed: {str(e)}")
+            result = {"status": "error", "message": f"Execution failed: {str(e)}"}
+        finished.set()
+        await flusher
+        # Together, so a poll that sees the job done also gets all of its events
+        events = [*take_output(), ("result", result), ("state", {"state": "done"})]
+        await self.service.blocking(self.store.add_job_events, job_id, events, "done", result)
+
+    def poll(self, job_id, user_id, since=None):
+        """State and result of the job, None unless it belongs to user_id. With since, also the
+        events after the first since ones and the cursor to ask for the next events with."""
+        job = self.store.get_job(job_id)
+        if job is None or job["user_id"] != user_id:
+            return None
+        polled = {"job_id": job_id, "state": job["state"], "result": job["result"]}
+        if since is not None:
+            # Read after the state, so a finished job lists all of its output
+            events = self.store.job_events(job_id, max(0, since))
+            polled["events"] = [{"event": event, "data": data} for event, data in events]
+            polled["next"] = max(0, since) + len(events)
+        return polled
+
+    def metrics(self):
+        return {"queued": 0, "running": 0, "done": 0, **self.store.job_counts()}
@@ -0,0 +1,120 @@
+import asyncio
+import hashlib
+import json
+import logging
+import shutil
+import sys
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Linting only reads the code, so ruff runs on the host instead of in the user's sandbox
+RUFF_COMMAND = [shutil.which("ruff")] if shutil.which("ruff") else [sys.executable, "-m", "ruff"]
+
+# One diagnostic of ruff's JSON output as sent to the frontend, positions are 1-based
+def _diagnostic(entry):
+    return {
+        # Older ruff versions report syntax errors without a code
+        "code": entry.get("code") or "invalid-syntax",
+        "message": entry["message"],
+        "line": entry["location"]["row"],
+        "column": entry["location"]["column"],
+        "end_line": entry["end_location"]["row"],
+        "end_column": entry["end_location"]["column"],
+    }
+
+class Linter:
+    """Runs ruff on code passed through stdin and remembers the results by code hash.
+
+    Requests of one session are coalesced: a lint waits coalesce_delay seconds before
+    ruff starts, and a newer request of the same session supersedes (cancels) the
+    older one, also while its ruff process is running. A burst of edits costs one run.
+    Only used from the sandbox service event loop, so it needs no locking."""
+
+    def __init__(self, max_entries=1024, max_processes=4, timeout=10, coalesce_delay=0.1):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.coalesce_delay = coalesce_delay
+        self.processes = asyncio.Semaphore(max_processes)
+        self.results = OrderedDict()    # sha256 of the code -> result, least recently used first
+        self.latest = {}                # session id -> task of its most recent lint request
+        self.hits = 0
+        self.misses = 0
+        self.superseded = 0
+
+    async def lint_latest(self, session_id, code):
+        """Lint for a session, resolves to status "superseded" if a newer request came in"""
+        previous = self.latest.get(session_id)
+        if previous is not None:
+            previous.cancel()
+        task = asyncio.ensure_future(self._lint_after_delay(code))
+        self.latest[session_id] = task
+        try:
+            await asyncio.wait({task})
+        finally:
+            if self.latest.get(session_id) is task:
+                del self.latest[session_id]
+        if task.cancelled():
+            self.superseded += 1
+            return {"status": "superseded"}
+        return task.result()
+
+    async def _lint_after_delay(self, code):
+        key = hashlib.sha256(code.encode()).hexdigest()
+        if key not in self.results:
+            await asyncio.sleep(self.coalesce_delay)
+        return await self.lint(code, key)
+
+    async def lint(self, code, key=None):
+        key = key or hashlib.sha256(code.encode()).hexdigest()
+        result = self.results.get(key)
+        if result is not None:
+            self.results.move_to_end(key)
+            self.hits += 1
+            return result
+        self.misses += 1
+        result, complete = await self._run_ruff(code)
+        if complete:
+            self.results[key] = result
+            if len(self.results) > self.max_entries:
+                self.results.popitem(last=False)
+        return result
+
+    async def _run_ruff(self, code):
+        """The result and whether ruff ran to completion (only those results are remembered)"""
+        command = [*RUFF_COMMAND, "check", "--isolated", "--no-cache", "--no-fix",
+                   "--output-format", "json", "--stdin-filename", "/script.py", "-"]
+        async with self.processes:
+            try:
+                process = await asyncio.create_subprocess_exec(
+                    *command, stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE)
+            except OSError as e:
+                logger.error(f"Could not start ruff: {e}")
+                return {"status": "error", "message": f"Linting failed: {e}"}, False
+            try:
+                output, errors = await asyncio.wait_for(process.communicate(code.encode()), self.timeout)
+            except asyncio.TimeoutError:
+                process.kill()
+                await process.wait()
+                return {"status": "error", "message": "Linting timed out"}, False
+            except asyncio.CancelledError:
+                # Superseded by a newer request, the result is not needed anymore
+                process.kill()
+                raise
+        logger.debug(f"Linting output: exit_code={process.returncode}, output={output}")
+        # ruff exits with 1 if it found issues and with 2 if it could not run
+        if process.returncode not in (0, 1):
+            return {"status": "error", "message": f"Linting failed: {errors.decode(errors='replace')}"}, False
+        diagnostics = [_diagnostic(entry) for entry in json.loads(output)]
+        diagnostics.sort(key=lambda d: (d["line"], d["column"]))
+        return {"status": "success", "diagnostics": diagnostics}, True
+
+    def metrics(self):
+        return {
+            "entries": len(self.results),
+            "hits": self.hits,
+            "misses": self.misses,
+            "superseded": self.superseded,
+            "pending": len(self.latest),
+        }
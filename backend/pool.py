@@ -0,0 +1,148 @@
+import logging
+import math
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+POOL_PREFIX = "sandbox_pool_"
+POOL_LABEL = "stormvogel.pool"
+
+# Parses a pool size spec like "latest=1,nightly=2,experimental=0"
+def parse_pool_sizes(spec, tags):
+    sizes = {tag: 0 for tag in tags}
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        tag, _, size = entry.partition("=")
+        tag = tag.strip()
+        if tag not in sizes:
+            logger.warning("Ignoring pool size for unknown tag %s", tag)
+            continue
+        try:
+            sizes[tag] = max(0, int(size))
+        except ValueError:
+            logger.warning("Ignoring invalid pool size %r for tag %s", size, tag)
+    return sizes
+
+class SandboxPool:
+    """Keeps a number of idle, already running sandbox containers per image tag.
+
+    The idle containers are listed in the shared registry (see registry.py), so all worker
+    processes hand out the same containers and the pool sizes and the sandbox limit hold
+    for the host. Every process refills the pool, a reservation in the registry decides
+    which one starts the next container.
+    """
+
+    def __init__(self, create_container, sizes, store, client=None, limit=None, refill_interval=30,
+                 reservation_timeout=120):
+        # create_container(tag) starts a new idle container labelled as pool member. Pool
+        # containers are only started while the host runs fewer than limit sandboxes.
+        self.create_container = create_container
+        self.sizes = dict(sizes)
+        self.store = store
+        self.client = client
+        self.limit = limit if limit is not None else math.inf
+        self.refill_interval = refill_interval
+        self.reservation_timeout = reservation_timeout
+        # Counters of this process
+        self.counters = {tag: {"hits": 0, "misses": 0, "created": 0, "failed": 0} for tag in self.sizes}
+        self.lock = threading.Lock()
+        self.refill_needed = threading.Event()
+        self.refill_thread = None
+
+    def start(self):
+        """Adopt the idle containers of an earlier process and keep the pool filled in the background"""
+        if self.client is not None:
+            self._adopt_existing(self.client)
+        self.refill_thread = threading.Thread(target=self._refill_loop, daemon=True)
+        self.refill_thread.start()
+        self.refill_needed.set()
+
+    def _adopt_existing(self, client):
+        """List the idle pool containers left behind by a previous backend process"""
+        for tag in self.sizes:
+            listed_at = time.time()
+            try:
+                containers = client.containers.list(filters={"label": f"{POOL_LABEL}={tag}"})
+            except Exception as e:
+                logger.error("Failed to list pool containers for %s: %s", tag, e)
+                continue
+            containers = [container for container in containers if container.name.startswith(POOL_PREFIX)]
+            for container in containers:
+                self.store.add_pool_container(container.id, tag)
+            self.store.prune_pool(tag, {container.id for container in containers}, listed_at)
+            logger.info("Adopted %d idle %s containers", len(containers), tag)
+
+    def _count(self, tag, counter):
+        with self.lock:
+            self.counters[tag][counter] += 1
+
+    def acquire(self, tag, name, user_id):
+        """Hand out an idle container renamed to name, or None if the pool is empty.
+        The container is registered as (starting) sandbox of user_id right away."""
+        while True:
+            container_id = self.store.take_pool_container(tag, user_id, name)
+            self.refill_needed.set()
+            if container_id is None:
+                if tag in self.counters:
+                    self._count(tag, "misses")
+                return None
+            try:
+                container = self.client.containers.get(container_id)
+                container.rename(name)
+                container.reload()
+                if container.status == "running":
+                    self._count(tag, "hits")
+                    return container
+                logger.warning("Discarding pool container %s with status %s", container_id, container.status)
+                container.remove(force=True)
+            except Exception as e:
+                # Container died or was removed underneath us, try the next one
+                logger.warning("Discarding broken pool container for %s: %s", tag, e)
+                try:
+                    self.client.containers.get(container_id).remove(force=True)
+                except Exception:
+                    pass
+            self.store.remove_container(container_id)
+
+    def _refill_loop(self):
+        while True:
+            self.refill_needed.wait(timeout=self.refill_interval)
+            self.refill_needed.clear()
+            for tag, size in self.sizes.items():
+                while True:
+                    token = f"reserved_{uuid.uuid4().hex}"
+                    if not self.store.reserve_pool_container(token, tag, size, self.limit, self.reservation_timeout):
+                        break
+                    try:
+                        container = self.create_container(tag)
+                    except Exception as e:
+                        logger.error("Failed to start pool container for %s: %s", tag, e)
+                        self.store.release_pool_reservation(token)
+                        self._count(tag, "failed")
+                        break
+                    if not self.store.pool_container_ready(token, container.id):
+                        # The reservation timed out and its place may be taken by now
+                        logger.warning("Discarding pool container %s that took too long to start", container.id)
+                        try:
+                            container.remove(force=True)
+                        except Exception:
+                            pass
+                        continue
+                    self._count(tag, "created")
+
+    def idle_count(self, tag=None):
+        """Number of idle containers of a tag, or of all tags"""
+        counts = self.store.pool_counts()
+        if tag is not None:
+            return counts.get(tag, 0)
+        return sum(counts.values())
+
+    def metrics(self):
+        """Current pool sizes and hit/miss counters (of this process) per tag"""
+        counts = self.store.pool_counts()
+        with self.lock:
+            return {
+                tag: {"target": self.sizes[tag], "idle": counts.get(tag, 0), **self.counters[tag]}
+                for tag in self.sizes
+            }
@@ -0,0 +1,94 @@
+# Precomputes the output of the bundled examples for every image tag
+#
+# Runs each example in frontend/public/examples in a sandbox per tag and stores the result
+# next to it as <example>.<tag>.json.gz, e.g. orchard/orchard_modeling.nightly.json.gz.
+# The playground shows these right away when an unedited example is opened or executed.
+# Run it from the backend directory (with Docker and the sandbox images available) whenever
+# the examples or the images change:
+#   python3 precompute_examples.py [--tags latest nightly] [--only orchard]
+import argparse
+import base64
+import gzip
+import hashlib
+import json
+import os
+import sys
+import tempfile
+
+# No warm pool and a registry of its own, the sandboxes of this script are stopped when it is done
+os.environ.setdefault("SANDBOX_POOL_SIZES", "latest=0,nightly=0,experimental=0")
+os.environ.setdefault("SANDBOX_REGISTRY_PATH", os.path.join(tempfile.gettempdir(), "stormvogel-precompute.sqlite3"))
+import sandbox
+
+EXAMPLES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "frontend", "public", "examples")
+
+# Path of the precomputed output of an example script for a tag
+def output_path(script_path, tag):
+    return f"{os.path.splitext(script_path)[0]}.{tag}.json.gz"
+
+# The precomputed output is a single file, so the artifacts of the run are embedded in it
+# as documents, images in a document of their own
+def inline_figure(artifact):
+    data = sandbox.read_artifact(artifact["id"])
+    if artifact["type"] == "html":
+        return data.decode()
+    encoded = base64.b64encode(data).decode()
+    return f'<!DOCTYPE html>\n<html><img src="data:{artifact["mime"]};base64,{encoded}" /></html>'
+
+# Example scripts with the other files of their directory (models, PRISM files), which are uploaded as tabs
+def find_examples(examples_dir, only=None):
+    for directory, _, filenames in sorted(os.walk(examples_dir)):
+        if only and os.path.basename(directory) not in only:
+            continue
+        files = {}
+        for filename in filenames:
+            if not filename.endswith(".gz"):
+                with open(os.path.join(directory, filename), "r", encoding="utf-8") as f:
+                    files[filename] = f.read()
+        for filename in sorted(files):
+            if filename.endswith(".py"):
+                tabs = {name: content for name, content in files.items() if not name.endswith(".py")}
+                yield os.path.join(directory, filename), files[filename], tabs
+
+def precompute(examples_dir, tags, only=None):
+    failures = 0
+    for tag in tags:
+        user_id = f"precompute_{tag}"
+        sandbox.start_sandbox(user_id, tag)
+        try:
+            for script_path, code, tabs in find_examples(examples_dir, only):
+                result = sandbox.execute_code(user_id, code, tabs, use_cache=False)
+                name = os.path.relpath(script_path, examples_dir)
+                if result["status"] != "success" or result.get("truncated"):
+                    # No output is better than a misleading one, the playground executes it live instead
+                    print(f"{tag} {name}: failed, {result.get('message', '')[:200]}", file=sys.stderr)
+                    if os.path.exists(output_path(script_path, tag)):
+                        os.remove(output_path(script_path, tag))
+                    failures += 1
+                    continue
+                output = {
+                    "source_sha256": hashlib.sha256(code.encode()).hexdigest(),
+                    # The image the output was computed with, the playground ignores it after an image update
+                    "image": sandbox.image_digest(tag),
+                    "figures": [inline_figure(artifact) for artifact in result["artifacts"]],
+                    "output_non_html": result["output_non_html"],
+                }
+                # mtime 0 keeps the file identical between runs with the same output
+                with gzip.GzipFile(output_path(script_path, tag), "wb", compresslevel=9, mtime=0) as f:
+                    f.write(json.dumps(output).encode())
+                print(f"{tag} {name}: ok")
+        finally:
+            sandbox.stop_sandbox(user_id)
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute the output of the bundled examples")
+    parser.add_argument("--examples", default=EXAMPLES_DIR, help="directory with the example scripts")
+    parser.add_argument("--tags", nargs="+", default=list(sandbox.IMAGE_TAGS), choices=sandbox.IMAGE_TAGS)
+    parser.add_argument("--only", nargs="+", help="only the examples in these directories (e.g. orchard)")
+    args = parser.parse_args()
+    failures = precompute(os.path.abspath(args.examples), args.tags, args.only)
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+import json
+import struct
+
+# Framing of the results file that playground.show() writes in the sandbox: every record is
+# a header with two big-endian 32 bit sizes, a JSON description and the raw payload.
+# Keep in sync with resources/playground.py.
+RECORD_HEADER = struct.Struct(">II")
+RECORD_TYPES = ("html", "image", "text", "metadata")
+
+class Record:
+    """One result of show(): its type ("html", "image", "text" or "metadata"), MIME type and payload"""
+
+    def __init__(self, description, payload):
+        self.type = description.get("type")
+        self.mime = description.get("mime", "application/octet-stream")
+        self.description = description
+        self.payload = payload
+
+    def text(self):
+        return self.payload.decode("utf-8", errors="replace")
+
+# Splits the results file into records. Sizes are read from the headers, the payloads are
+# never scanned. A record cut off at the end (the script was killed while writing it) and
+# records of an unknown type are dropped.
+def parse_records(data):
+    records = []
+    offset = 0
+    view = memoryview(data)
+    while offset + RECORD_HEADER.size <= len(data):
+        description_size, payload_size = RECORD_HEADER.unpack_from(data, offset)
+        start = offset + RECORD_HEADER.size
+        end = start + description_size + payload_size
+        if end > len(data):
+            break
+        try:
+            description = json.loads(bytes(view[start:start + description_size]))
+        except ValueError:
+            break
+        offset = end
+        if isinstance(description, dict) and description.get("type") in RECORD_TYPES:
+            records.append(Record(description, bytes(view[start + description_size:end])))
+    return records
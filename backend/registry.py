@@ -0,0 +1,397 @@
+import json
+import math
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sandboxes (
+    user_id TEXT PRIMARY KEY,
+    container_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    tag TEXT,
+    state TEXT NOT NULL,
+    created REAL NOT NULL,
+    last_used REAL NOT NULL,
+    deadline REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sandboxes_container ON sandboxes (container_id);
+CREATE INDEX IF NOT EXISTS sandboxes_deadline ON sandboxes (deadline);
+CREATE TABLE IF NOT EXISTS uploads (
+    container_id TEXT NOT NULL,
+    path TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    PRIMARY KEY (container_id, path)
+);
+CREATE TABLE IF NOT EXISTS pool (
+    container_id TEXT PRIMARY KEY,
+    tag TEXT NOT NULL,
+    state TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS clean_containers (
+    container_id TEXT PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS execution_slots (
+    token TEXT PRIMARY KEY,
+    acquired REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS execution_turns (
+    user_id TEXT PRIMARY KEY,
+    token TEXT NOT NULL,
+    acquired REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS rate_buckets (
+    user_id TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS rate_buckets_updated ON rate_buckets (updated);
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    state TEXT NOT NULL,
+    result TEXT,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS job_events (
+    job_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    event TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (job_id, seq)
+);
+"""
+
+class SharedRegistry:
+    """Sandbox registry in a SQLite file (WAL mode) shared by all backend worker processes.
+
+    Every process reads and writes the same rows, so a sandbox started by one gunicorn
+    worker is found by the others, and an expired sandbox is claimed (deleted) by exactly
+    one reaper in a single transaction. Content hashes of uploaded files live here as well,
+    so no worker skips an upload based on what only it has seen.
+
+    Everything else that has to hold over all workers is kept here too: the idle pool
+    containers, the running executions and the execution turn of each user, the rate limit
+    buckets and the jobs with their events, so a poll can be answered by any worker.
+    """
+
+    def __init__(self, path, idle_ttl, max_lifetime):
+        self.path = path
+        self.idle_ttl = idle_ttl
+        self.max_lifetime = max_lifetime
+        self.local = threading.local()
+        self._connection().executescript(SCHEMA)
+
+    def _connection(self):
+        db = getattr(self.local, "db", None)
+        if db is None:
+            # Autocommit mode, transactions are started explicitly in transaction()
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.row_factory = sqlite3.Row
+            self.local.db = db
+        return db
+
+    def transaction(self):
+        return _Transaction(self._connection())
+
+    def _deadline(self, created, last_used):
+        return min(last_used + self.idle_ttl, created + self.max_lifetime)
+
+    def put(self, user_id, container_id, name, tag, state, since=None):
+        """Insert or replace the sandbox of a user. Timestamps are kept if the container is the same."""
+        now = time.time()
+        with self.transaction() as db:
+            row = db.execute("SELECT container_id, created, last_used FROM sandboxes WHERE user_id = ?",
+                             (user_id,)).fetchone()
+            if row is not None and row["container_id"] == container_id:
+                created, last_used = row["created"], row["last_used"]
+            elif row is not None and since is not None and row["last_used"] >= since:
+                return   # replaced by another worker after the caller looked at Docker
+            else:
+                created, last_used = now, now
+            db.execute("INSERT OR REPLACE INTO sandboxes VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                       (user_id, container_id, name, tag, state, created, last_used,
+                        self._deadline(created, last_used)))
+
+    def touch(self, user_id):
+        """Mark the sandbox as used now, returns its new deadline (or None if it is unknown)"""
+        now = time.time()
+        with self.transaction() as db:
+            row = db.execute("SELECT created FROM sandboxes WHERE user_id = ?", (user_id,)).fetchone()
+            if row is None:
+                return None
+            deadline = self._deadline(row["created"], now)
+            db.execute("UPDATE sandboxes SET last_used = ?, deadline = ? WHERE user_id = ?",
+                       (now, deadline, user_id))
+            return deadline
+
+    def get(self, user_id):
+        row = self._connection().execute("SELECT * FROM sandboxes WHERE user_id = ?", (user_id,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def remove(self, user_id):
+        with self.transaction() as db:
+            db.execute("DELETE FROM sandboxes WHERE user_id = ?", (user_id,))
+
+    def set_state(self, container_id, state):
+        """Update the state of a container, returns False if it is not registered"""
+        with self.transaction() as db:
+            return db.execute("UPDATE sandboxes SET state = ? WHERE container_id = ?",
+                              (state, container_id)).rowcount > 0
+
+    def remove_container(self, container_id):
+        with self.transaction() as db:
+            db.execute("DELETE FROM sandboxes WHERE container_id = ?", (container_id,))
+            db.execute("DELETE FROM uploads WHERE container_id = ?", (container_id,))
+            db.execute("DELETE FROM pool WHERE container_id = ?", (container_id,))
+            db.execute("DELETE FROM clean_containers WHERE container_id = ?", (container_id,))
+
+    def reserve_pool_container(self, token, tag, size, limit, stale_after):
+        """Reserve a place in the pool of a tag while it has fewer than size containers and the
+        host fewer than limit sandboxes (pool containers included). Reservations older than
+        stale_after seconds belonged to a process that died and are dropped."""
+        now = time.time()
+        with self.transaction() as db:
+            db.execute("DELETE FROM pool WHERE state = 'starting' AND created < ?", (now - stale_after,))
+            if db.execute("SELECT COUNT(*) FROM pool WHERE tag = ?", (tag,)).fetchone()[0] >= size:
+                return False
+            if self._sandbox_count(db) >= limit:
+                return False
+            db.execute("INSERT INTO pool VALUES (?, ?, 'starting', ?)", (token, tag, now))
+            return True
+
+    def pool_container_ready(self, token, container_id):
+        """Turn a reservation into an idle container, False if the reservation was dropped"""
+        with self.transaction() as db:
+            return db.execute("UPDATE pool SET container_id = ?, state = 'idle' WHERE container_id = ?",
+                              (container_id, token)).rowcount == 1
+
+    def release_pool_reservation(self, token):
+        with self.transaction() as db:
+            db.execute("DELETE FROM pool WHERE container_id = ?", (token,))
+
+    def add_pool_container(self, container_id, tag):
+        """List an idle pool container found in Docker, e.g. one left by an earlier process"""
+        with self.transaction() as db:
+            db.execute("INSERT OR IGNORE INTO pool VALUES (?, ?, 'idle', ?)", (container_id, tag, time.time()))
+
+    def prune_pool(self, tag, container_ids, since):
+        """Drop the idle pool containers of a tag that no longer exist, unless they were added after since"""
+        with self.transaction() as db:
+            rows = db.execute("SELECT container_id FROM pool WHERE tag = ? AND state = 'idle' AND created < ?",
+                              (tag, since)).fetchall()
+            db.executemany("DELETE FROM pool WHERE container_id = ?",
+                           [(row[0],) for row in rows if row[0] not in container_ids])
+
+    def take_pool_container(self, tag, user_id, name):
+        """Hand the oldest idle pool container of a tag to a user, None if there is none.
+        The user's sandbox is registered (as starting) in the same transaction, so the container
+        is counted as a sandbox all the time and no other process can take it."""
+        now = time.time()
+        with self.transaction() as db:
+            row = db.execute("SELECT container_id FROM pool WHERE tag = ? AND state = 'idle' ORDER BY created LIMIT 1",
+                             (tag,)).fetchone()
+            if row is None:
+                return None
+            db.execute("DELETE FROM pool WHERE container_id = ?", (row[0],))
+            db.execute("INSERT OR REPLACE INTO sandboxes VALUES (?, ?, ?, ?, 'starting', ?, ?, ?)",
+                       (user_id, row[0], name, tag, now, now, self._deadline(now, now)))
+            return row[0]
+
+    def reserve_sandbox(self, user_id, token, name, tag, limit, timeout):
+        """Register a placeholder (state starting, token as container id) for a sandbox that is
+        about to be created, False if the host already has limit sandboxes and pool containers.
+        Counting and inserting happen in one transaction, so concurrent startups cannot overshoot.
+        The placeholder expires after timeout seconds if its process dies before it is replaced."""
+        now = time.time()
+        with self.transaction() as db:
+            others = db.execute("SELECT COUNT(*) FROM sandboxes WHERE user_id != ?", (user_id,)).fetchone()[0]
+            if others + db.execute("SELECT COUNT(*) FROM pool").fetchone()[0] >= limit:
+                return False
+            db.execute("INSERT OR REPLACE INTO sandboxes VALUES (?, ?, ?, ?, 'starting', ?, ?, ?)",
+                       (user_id, token, name, tag, now, now, now + timeout))
+            return True
+
+    def release_sandbox(self, user_id, token):
+        """Drop the placeholder of a sandbox that could not be created"""
+        with self.transaction() as db:
+            db.execute("DELETE FROM sandboxes WHERE user_id = ? AND container_id = ?", (user_id, token))
+
+    def pool_counts(self):
+        """Idle pool containers per tag"""
+        rows = self._connection().execute("SELECT tag, COUNT(*) FROM pool WHERE state = 'idle' GROUP BY tag").fetchall()
+        return {tag: count for tag, count in rows}
+
+    @staticmethod
+    def _sandbox_count(db):
+        return (db.execute("SELECT COUNT(*) FROM sandboxes").fetchone()[0]
+                + db.execute("SELECT COUNT(*) FROM pool").fetchone()[0])
+
+    def acquire_turn(self, user_id, token, stale_after):
+        """Take the execution turn of a user, False while another execution of the user has it.
+        A turn held longer than stale_after seconds belonged to a process that died and is freed."""
+        now = time.time()
+        with self.transaction() as db:
+            db.execute("DELETE FROM execution_turns WHERE user_id = ? AND acquired < ?", (user_id, now - stale_after))
+            return db.execute("INSERT OR IGNORE INTO execution_turns VALUES (?, ?, ?)",
+                              (user_id, token, now)).rowcount == 1
+
+    def release_turn(self, user_id, token):
+        with self.transaction() as db:
+            db.execute("DELETE FROM execution_turns WHERE user_id = ? AND token = ?", (user_id, token))
+
+    def take_tokens(self, user_id, cost, rate, burst):
+        """Token bucket of a user: takes cost tokens, tokens refill at rate per second up to burst.
+        Returns 0 if that was possible, otherwise the number of seconds after which it will be."""
+        now = time.time()
+        with self.transaction() as db:
+            row = db.execute("SELECT tokens, updated FROM rate_buckets WHERE user_id = ?", (user_id,)).fetchone()
+            tokens = burst if row is None else min(burst, row["tokens"] + (now - row["updated"]) * rate)
+            if tokens < cost:
+                db.execute("INSERT OR REPLACE INTO rate_buckets VALUES (?, ?, ?)", (user_id, tokens, now))
+                return max(1, math.ceil((cost - tokens) / rate))
+            db.execute("INSERT OR REPLACE INTO rate_buckets VALUES (?, ?, ?)", (user_id, tokens - cost, now))
+            # A full bucket is the same as no bucket
+            db.execute("DELETE FROM rate_buckets WHERE updated < ?", (now - burst / rate,))
+            return 0
+
+    def rate_bucket_count(self):
+        return self._connection().execute("SELECT COUNT(*) FROM rate_buckets").fetchone()[0]
+
+    def create_job(self, job_id, user_id):
+        with self.transaction() as db:
+            db.execute("INSERT INTO jobs VALUES (?, ?, 'queued', NULL, ?)", (job_id, user_id, time.time()))
+            db.execute("INSERT INTO job_events VALUES (?, 0, 'state', ?)", (job_id, json.dumps({"state": "queued"})))
+
+    def add_job_events(self, job_id, events, state=None, result=None):
+        """Append (event, data) pairs to a job, and set its state (and result) in the same transaction"""
+        with self.transaction() as db:
+            seq = db.execute("SELECT COALESCE(MAX(seq) + 1, 0) FROM job_events WHERE job_id = ?", (job_id,)).fetchone()[0]
+            db.executemany("INSERT INTO job_events VALUES (?, ?, ?, ?)",
+                           [(job_id, seq + i, event, json.dumps(data)) for i, (event, data) in enumerate(events)])
+            if state is not None:
+                db.execute("UPDATE jobs SET state = ?, result = ?, updated = ? WHERE job_id = ?",
+                           (state, json.dumps(result) if result is not None else None, time.time(), job_id))
+            else:
+                db.execute("UPDATE jobs SET updated = ? WHERE job_id = ?", (time.time(), job_id))
+
+    def get_job(self, job_id):
+        row = self._connection().execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["result"] = json.loads(job["result"]) if job["result"] is not None else None
+        return job
+
+    def job_events(self, job_id, since=0):
+        """The (event, data) pairs of a job after the first since ones"""
+        rows = self._connection().execute("SELECT event, data FROM job_events WHERE job_id = ? AND seq >= ? ORDER BY seq",
+                                          (job_id, since)).fetchall()
+        return [(event, json.loads(data)) for event, data in rows]
+
+    def expire_jobs(self, before):
+        """Remove the jobs that did not change since before, finished or abandoned by a process that died"""
+        with self.transaction() as db:
+            expired = [(row[0],) for row in db.execute("SELECT job_id FROM jobs WHERE updated < ?", (before,))]
+            db.executemany("DELETE FROM jobs WHERE job_id = ?", expired)
+            db.executemany("DELETE FROM job_events WHERE job_id = ?", expired)
+
+    def job_counts(self):
+        rows = self._connection().execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall()
+        return {state: count for state, count in rows}
+
+    def mark_clean(self, container_id):
+        """Remember a container that has not run any user code yet"""
+        with self.transaction() as db:
+            db.execute("INSERT OR IGNORE INTO clean_containers VALUES (?)", (container_id,))
+
+    def take_clean(self, container_id):
+        """True if the container was still clean, it is not once user code runs in it"""
+        with self.transaction() as db:
+            return db.execute("DELETE FROM clean_containers WHERE container_id = ?",
+                              (container_id,)).rowcount == 1
+
+    def acquire_execution_slot(self, token, limit, stale_after):
+        """Take one of limit execution slots shared by all processes, False if all are taken.
+        Slots held longer than stale_after seconds belonged to a process that died and are freed."""
+        now = time.time()
+        with self.transaction() as db:
+            db.execute("DELETE FROM execution_slots WHERE acquired < ?", (now - stale_after,))
+            if db.execute("SELECT COUNT(*) FROM execution_slots").fetchone()[0] >= limit:
+                return False
+            db.execute("INSERT INTO execution_slots VALUES (?, ?)", (token, now))
+            return True
+
+    def release_execution_slot(self, token):
+        with self.transaction() as db:
+            db.execute("DELETE FROM execution_slots WHERE token = ?", (token,))
+
+    def running_executions(self):
+        return self._connection().execute("SELECT COUNT(*) FROM execution_slots").fetchone()[0]
+
+    def prune(self, container_ids, since):
+        """Drop sandboxes whose container no longer exists, unless they were touched after since"""
+        with self.transaction() as db:
+            # Sandboxes that are still starting may not be renamed or listed yet
+            rows = db.execute("SELECT user_id, container_id FROM sandboxes WHERE last_used < ? AND state != 'starting'",
+                              (since,)).fetchall()
+            for row in rows:
+                if row["container_id"] not in container_ids:
+                    db.execute("DELETE FROM sandboxes WHERE user_id = ?", (row["user_id"],))
+                    db.execute("DELETE FROM uploads WHERE container_id = ?", (row["container_id"],))
+                    db.execute("DELETE FROM clean_containers WHERE container_id = ?", (row["container_id"],))
+
+    def next_deadline(self):
+        row = self._connection().execute("SELECT MIN(deadline) FROM sandboxes").fetchone()
+        return row[0]
+
+    def claim_expired(self, now=None):
+        """Remove and return one sandbox past its deadline. Only one process gets each sandbox."""
+        now = time.time() if now is None else now
+        with self.transaction() as db:
+            row = db.execute("SELECT * FROM sandboxes WHERE deadline <= ? ORDER BY deadline LIMIT 1",
+                             (now,)).fetchone()
+            if row is None:
+                return None
+            db.execute("DELETE FROM sandboxes WHERE user_id = ?", (row["user_id"],))
+            return dict(row)
+
+    def counts(self):
+        rows = self._connection().execute("SELECT state, COUNT(*) FROM sandboxes GROUP BY state").fetchall()
+        return {state: count for state, count in rows}
+
+    def uploads(self, container_id):
+        """Content hashes of the files uploaded to a container, keyed by path"""
+        rows = self._connection().execute("SELECT path, digest FROM uploads WHERE container_id = ?",
+                                          (container_id,)).fetchall()
+        return {path: digest for path, digest in rows}
+
+    def record_uploads(self, container_id, digests):
+        with self.transaction() as db:
+            db.executemany("INSERT OR REPLACE INTO uploads VALUES (?, ?, ?)",
+                           [(container_id, path, digest) for path, digest in digests.items()])
+
+    def forget_uploads(self, container_id, paths=None):
+        with self.transaction() as db:
+            if paths is None:
+                db.execute("DELETE FROM uploads WHERE container_id = ?", (container_id,))
+            else:
+                db.executemany("DELETE FROM uploads WHERE container_id = ? AND path = ?",
+                               [(container_id, path) for path in paths])
+
+class _Transaction:
+    """BEGIN IMMEDIATE ... COMMIT, so concurrent writers queue up instead of failing on upgrade"""
+
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        self.db.execute("BEGIN IMMEDIATE")
+        return self.db
+
+    def __exit__(self, exc_type, exc, tb):
+        self.db.execute("COMMIT" if exc_type is None else "ROLLBACK")
+        return False
@@ -0,0 +1,183 @@
+# Summaries of models that are too large to draw completely
+#
+# Past MAX_STATES states or MAX_TRANSITIONS transitions, the network of a whole model is
+# more than the browser can lay out. show() then renders a summary (sizes, label histogram,
+# result statistics) and the neighbourhood of the initial states (or of chosen states).
+# The model is described by a ModelGraph, so models of every library are handled alike;
+# stormpy_models.py renders checked stormpy models of any size this way.
+import functools
+import html
+import json
+import math
+import os
+from collections import Counter, deque
+
+MAX_STATES = 1000
+MAX_TRANSITIONS = 5000
+SUBGRAPH_STATES = 100
+HISTOGRAM_LABELS = 20
+# Used when stormvogel's copy of vis-network cannot be found
+VIS_NETWORK_URL = "https://unpkg.com/vis-network@9.1.9/standalone/umd/vis-network.min.js"
+
+class ModelGraph:
+    """What the summary needs to know about a model.
+
+    successors(state) lists the outgoing transitions of a state as (action, probability, target)
+    tuples, the action is "" for models without actions. labels(state) is a list of strings.
+    For checked models, value(state) is the result of a state and statistics the
+    value_statistics of all results."""
+
+    def __init__(self, model_type, num_states, num_transitions, initial_states, successors, labels,
+                 label_counts, value=None, statistics=None):
+        self.model_type = model_type
+        self.num_states = num_states
+        self.num_transitions = num_transitions
+        self.initial_states = initial_states
+        self.successors = successors
+        self.labels = labels
+        self.label_counts = label_counts
+        self.value = value
+        self.statistics = statistics
+
+def is_large(num_states, num_transitions, max_states=MAX_STATES, max_transitions=MAX_TRANSITIONS):
+    return num_states > max_states or num_transitions > max_transitions
+
+def neighbourhood(successors, start, max_states=SUBGRAPH_STATES):
+    """The first max_states states found by a breadth-first search from the start states"""
+    found = list(dict.fromkeys(start))[:max_states]
+    seen = set(found)
+    queue = deque(found)
+    while queue and len(found) < max_states:
+        for _, _, target in successors(queue.popleft()):
+            if target not in seen:
+                seen.add(target)
+                found.append(target)
+                queue.append(target)
+                if len(found) == max_states:
+                    break
+    return found
+
+def value_statistics(values):
+    """Count, minimum, maximum and mean of the numeric values, None if there are none"""
+    numbers = []
+    for value in values:
+        try:
+            number = float(value)
+        except (TypeError, ValueError):
+            continue
+        if not math.isnan(number):
+            numbers.append(number)
+    if not numbers:
+        return None
+    return {"count": len(numbers), "min": min(numbers), "max": max(numbers), "mean": math.fsum(numbers) / len(numbers)}
+
+def summary(graph):
+    """The summary of a model as a dict, passed on as metadata of the execution"""
+    result = {
+        "model_type": graph.model_type,
+        "states": graph.num_states,
+        "transitions": graph.num_transitions,
+        "labels": dict(Counter(graph.label_counts).most_common(HISTOGRAM_LABELS)),
+    }
+    if graph.value is not None:
+        result["result"] = graph.statistics
+    return result
+
+def _format_number(value):
+    try:
+        return f"{float(value):.4g}"
+    except (TypeError, ValueError):
+        return str(value)
+
+@functools.lru_cache(maxsize=1)
+def _vis_network_script():
+    try:
+        import stormvogel
+        directory = os.path.dirname(stormvogel.__file__)
+        for filename in sorted(os.listdir(directory)):
+            if filename.startswith("vis-network") and filename.endswith(".js"):
+                with open(os.path.join(directory, filename), encoding="utf-8") as f:
+                    return f"<script>{f.read()}</script>"
+    except (ImportError, OSError):
+        pass
+    return f'<script src="{VIS_NETWORK_URL}"></script>'
+
+def _script_json(data):
+    # "</" would end the script element early
+    return json.dumps(data).replace("</", "<\\/")
+
+def subgraph(graph, states):
+    """Nodes and edges of vis-network for the given states and the transitions between them.
+    States with transitions to states outside the subgraph are drawn with a dashed border."""
+    included = set(states)
+    nodes, edges = [], []
+    for state in states:
+        label = ", ".join(graph.labels(state)) or str(state)
+        value = graph.value(state) if graph.value is not None else None
+        if value is not None:
+            label += f"\n{_format_number(value)}"
+        node = {"id": state, "label": label}
+        if state in graph.initial_states:
+            node["color"] = {"border": "#d00"}
+        for action, probability, target in graph.successors(state):
+            if target not in included:
+                node["shapeProperties"] = {"borderDashes": [4, 4]}
+                continue
+            edge_label = _format_number(probability)
+            edges.append({"from": state, "to": target, "arrows": "to",
+                          "label": f"{action}: {edge_label}" if action else edge_label})
+        nodes.append(node)
+    return nodes, edges
+
+def render(graph, around=None, max_states=SUBGRAPH_STATES, top_states=None):
+    """HTML document with the summary of the model and a subgraph around the given states
+    (by default the initial states). top_states are listed with their result in a table."""
+    info = summary(graph)
+    shown = neighbourhood(graph.successors, around if around is not None else graph.initial_states, max_states)
+    nodes, edges = subgraph(graph, shown)
+    rows = [("Model type", graph.model_type), ("States", f"{graph.num_states:,}"),
+            ("Transitions", f"{graph.num_transitions:,}")]
+    statistics = info.get("result")
+    if statistics is not None:
+        rows += [("Result minimum", _format_number(statistics["min"])),
+                 ("Result maximum", _format_number(statistics["max"])),
+                 ("Result mean", _format_number(statistics["mean"]))]
+    table = "".join(f"<tr><th>{html.escape(name)}</th><td>{html.escape(str(value))}</td></tr>" for name, value in rows)
+    histogram = "".join(f"<tr><td>{html.escape(label)}</td><td>{count:,}</td></tr>"
+                        for label, count in info["labels"].items())
+    results = ""
+    if top_states:
+        results = "<table><tr><th>State</th><th>Labels</th><th>Result</th></tr>" + "".join(
+            f"<tr><td>{state}</td><td>{html.escape(', '.join(graph.labels(state)))}</td>"
+            f"<td>{html.escape(_format_number(graph.value(state)))}</td></tr>" for state in top_states) + "</table>"
+    note = ""
+    if len(nodes) < graph.num_states:
+        note = (f"<p>This model is too large to draw completely. It shows the {len(nodes)} states closest to "
+                f"{'the chosen states' if around is not None else 'the initial states'}, "
+                "use show(..., full=True) to draw all of it.</p>")
+    return f"""<!DOCTYPE html>
+<html lang="en">
+  <head>
+    <title>Model summary</title>
+    {_vis_network_script()}
+    <style>
+      body {{ font-family: sans-serif; font-size: 14px; }}
+      table {{ border-collapse: collapse; margin-bottom: 1em; }}
+      th, td {{ text-align: left; padding: 2px 12px 2px 0; }}
+      #network {{ width: 100%; height: 600px; border: 1px solid lightgray; }}
+    </style>
+  </head>
+  <body>
+    {note}
+    <table>{table}</table>
+    {results}
+    <table><tr><th>Label</th><th>States</th></tr>{histogram}</table>
+    <div id="network"></div>
+    <script>
+      new vis.Network(document.getElementById("network"), {{
+        nodes: new vis.DataSet({_script_json(nodes)}),
+        edges: new vis.DataSet({_script_json(edges)}),
+      }}, {{ physics: {{ stabilization: {{ iterations: 200 }} }} }});
+    </script>
+  </body>
+</html>"""
@@ -1,48 +1,119 @@
 # Playground utility functions
 import stormvogel
-import base64
 import os
 import io
+import json
+import struct
+from collections import Counter
 import matplotlib.figure
+import large_models
 
-def show(something: any, something_other: any = None, **kwargs) -> str:
-    """
-    Convert the input to HTML for display in the playground.
-    """
-    def add_doctype(html: str) -> str:
-        """Add a doctype to the HTML string."""
-        return f"<!DOCTYPE html>\n<html>{html}</html>"
+# Results of show() are appended to this file as framed records instead of being printed,
+# the runner removes it before every execution and the backend reads it afterwards.
+# Each record is a header (two big-endian 32 bit sizes), a JSON description
+# ({"type": "html" | "image" | "text" | "metadata", "mime": ...}) and the raw payload.
+RESULTS_PATH = "/tmp/playground-results"
+RECORD_HEADER = struct.Struct(">II")
+# Image files that can be shown, and the formats figures can be rendered in (show(fig, format="svg"))
+IMAGE_TYPES = {".png": "image/png", ".gif": "image/gif", ".jpg": "image/jpeg", ".jpeg": "image/jpeg",
+               ".svg": "image/svg+xml", ".webp": "image/webp"}
+FIGURE_FORMATS = {"png": "image/png", "svg": "image/svg+xml", "webp": "image/webp"}
 
-    if isinstance(something, stormvogel.Model):
-        vis = stormvogel._show(something, something_other, do_init_server=False, **kwargs)
-        print(vis.generate_html())
-    elif str(type(something)).startswith("<class 'stormpy.storage.storage.Sparse"):
+def write_record(record_type: str, payload: bytes, mime: str, **fields) -> None:
+    """Append one record to the results file."""
+    description = json.dumps({"type": record_type, "mime": mime, **fields}).encode("utf-8")
+    with open(RESULTS_PATH, "ab") as f:
+        f.write(RECORD_HEADER.pack(len(description), len(payload)) + description + payload)
+
+def _stormvogel_graph(model, result=None) -> large_models.ModelGraph:
+    """Describe a stormvogel model (and result) for the summary of large models."""
+    transitions = model.transitions
+    states = model.get_states()
+
+    def successors(state_id):
+        transition = transitions.get(state_id)
+        if transition is None:
+            return []
+        return [(",".join(sorted(action.labels)), probability, target.id)
+                for action, branch in transition.transition.items() for probability, target in branch.branch]
+
+    num_transitions = sum(len(branch.branch) for transition in transitions.values()
+                          for branch in transition.transition.values())
+    label_counts = Counter(label for state in states.values() for label in state.labels)
+    return large_models.ModelGraph(
+        str(model.get_type().name), len(states), num_transitions, [model.get_initial_state().id], successors,
+        lambda state_id: states[state_id].labels, label_counts,
+        result.values.get if result is not None else None,
+        large_models.value_statistics(result.values.values()) if result is not None else None)
+
+def _show_model(model, result=None, full=False, around=None, subgraph_states=large_models.SUBGRAPH_STATES,
+                max_transitions=large_models.MAX_TRANSITIONS, **kwargs) -> None:
+    """Show a stormvogel model, or a summary and part of it if it is too large to draw completely."""
+    graph = _stormvogel_graph(model, result)
+    max_states = kwargs.get("max_states", large_models.MAX_STATES)
+    if full or not large_models.is_large(graph.num_states, graph.num_transitions, max_states, max_transitions):
+        if graph.num_states > max_states:
+            kwargs["max_states"] = graph.num_states  # stormvogel refuses to draw larger models
+        vis = stormvogel._show(model, result, do_init_server=False, **kwargs)
+        write_record("html", vis.generate_html().encode("utf-8"), "text/html")
+        return
+    write_record("html", large_models.render(graph, around, subgraph_states).encode("utf-8"), "text/html")
+    write_record("metadata", json.dumps(large_models.summary(graph)).encode("utf-8"), "application/json")
+
+def _show_stormpy_model(model, result=None, full=False, top_k=10, label=None, around=None,
+                        subgraph_states=large_models.SUBGRAPH_STATES, max_transitions=large_models.MAX_TRANSITIONS,
+                        **kwargs) -> None:
+    """Show a stormpy sparse model. Checked and large models are rendered from the sparse matrix
+    directly, only small models without a result are converted to stormvogel to be drawn."""
+    max_states = kwargs.get("max_states", large_models.MAX_STATES)
+    large = large_models.is_large(model.nr_states, model.nr_transitions, max_states, max_transitions)
+    if full or (result is None and not large):
         import stormvogel.stormpy_utils.mapping as mapping
         import stormvogel.stormpy_utils.convert_results as convert_results
 
-        stormvogel_model = mapping.stormpy_to_stormvogel(something)
+        stormvogel_model = mapping.stormpy_to_stormvogel(model)
         stormvogel_result = None
-        if something_other is not None:
-            stormvogel_result = convert_results.convert_model_checking_result(stormvogel_model, something_other)
-        vis = stormvogel._show(stormvogel_model, stormvogel_result, do_init_server=False, **kwargs)
-        print(vis.generate_html())
+        if result is not None:
+            stormvogel_result = convert_results.convert_model_checking_result(stormvogel_model, result)
+        _show_model(stormvogel_model, stormvogel_result, full=full, around=around, subgraph_states=subgraph_states,
+                    max_transitions=max_transitions, **kwargs)
+        return
+    import stormpy_models
+
+    document, summary = stormpy_models.render(model, result, top_k, label, around, subgraph_states)
+    write_record("html", document.encode("utf-8"), "text/html")
+    write_record("metadata", json.dumps(summary).encode("utf-8"), "application/json")
+
+def show(something: any, something_other: any = None, **kwargs) -> str:
+    """
+    Display the input in the playground, every call adds a visualization.
+    Matplotlib figures are rendered as PNG unless format="svg" or format="webp" is given.
+    Models with more than max_states states (1000) or max_transitions transitions (5000) are
+    summarized, with the subgraph_states states (100) closest to the initial states or to the
+    states listed in around. full=True draws them completely anyway.
+    stormpy models with a result are shown without converting them to stormvogel: a summary,
+    the top_k (10) states with the highest result and a subgraph. label="..." only considers
+    the states with that label.
+    """
+    if isinstance(something, stormvogel.Model):
+        _show_model(something, something_other, **kwargs)
+    elif str(type(something)).startswith("<class 'stormpy.storage.storage.Sparse"):
+        _show_stormpy_model(something, something_other, **kwargs)
     elif isinstance(something, str) and os.path.isfile(something):
         ext = os.path.splitext(something)[1].lower()
-        if ext in [".png", ".gif", ".jpg", ".jpeg"]:
+        if ext in IMAGE_TYPES:
             with open(something, "rb") as img_file:
-                encoded = base64.b64encode(img_file.read()).decode("utf-8")
-            mime = "image/png" if ext == ".png" else "image/gif" if ext == ".gif" else "image/jpeg"
-            html = f'<img src="data:{mime};base64,{encoded}" />'
-            print(add_doctype(html))
+                data = img_file.read()
+            write_record("image", data, IMAGE_TYPES[ext], name=os.path.basename(something))
     elif (hasattr(something, "figure") and callable(getattr(something, "figure", None))) or isinstance(something, matplotlib.figure.Figure):
         import matplotlib.pyplot as plt
         fig = something.figure if hasattr(something, "figure") else something
+        image_format = kwargs.get("format", "png")
+        if image_format not in FIGURE_FORMATS:
+            raise ValueError(f"Unsupported figure format {image_format}, use one of {', '.join(FIGURE_FORMATS)}.")
         buf = io.BytesIO()
-        fig.savefig(buf, format="png", bbox_inches="tight")
-        buf.seek(0)
-        encoded = base64.b64encode(buf.read()).decode("utf-8")
-        html = f'<img src="data:image/png;base64,{encoded}" />'
-        print(add_doctype(html))
+        fig.savefig(buf, format=image_format, bbox_inches="tight")
+        write_record("image", buf.getvalue(), FIGURE_FORMATS[image_format])
         plt.close(fig)
     else:   
         raise RuntimeError(f"I don't know how to display {something} of type {type(something)}.")
@@ -0,0 +1,147 @@
+# Persistent script runner for the playground sandbox
+#
+# "python3 /runner.py --serve" pre-imports the heavy libraries once and then forks a fresh
+# child for every submission (zygote style), so executions skip the import cost.
+# "python3 /runner.py <script> [timeout]" is the client used by the backend, it hands its
+# stdin/stdout/stderr to the runner and exits with the exit code of the script.
+import json
+import os
+import signal
+import socket
+import sys
+
+SOCKET_PATH = "/runner.sock"
+TIMEOUT_EXIT_CODE = 124  # same exit code as the coreutils timeout command
+RUNNER_FAILURE_EXIT_CODE = 125  # the runner itself failed, like timeout does
+RESULTS_PATH = "/tmp/playground-results"  # records written by playground.show(), see playground.py
+
+class _Timeout(Exception):
+    pass
+
+def _preload():
+    """Import everything a typical playground script needs, missing modules are skipped"""
+    for module in ("stormpy", "stormvogel", "matplotlib.pyplot", "playground"):
+        try:
+            __import__(module)
+        except Exception as e:
+            print(f"runner: could not preload {module}: {e}", file=sys.stderr)
+
+def _run_script(script):
+    """Runs in the forked child, behaves like 'python3 <script>'"""
+    import runpy
+    import traceback
+    sys.argv = [script]
+    sys.path[0] = os.path.dirname(script)
+    # Flush every line, so the backend can stream the output while the script runs
+    sys.stdout.reconfigure(line_buffering=True)
+    try:
+        runpy.run_path(script, run_name="__main__")
+        code = 0
+    except SystemExit as e:
+        code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+        if not isinstance(e.code, int) and e.code is not None:
+            print(e.code, file=sys.stderr)
+    except BaseException as e:
+        # Hide the runner and runpy frames, the traceback should start in the script
+        tb = e.__traceback__
+        while tb is not None and tb.tb_frame.f_code.co_filename != script:
+            tb = tb.tb_next
+        traceback.print_exception(type(e), e, tb or e.__traceback__)
+        code = 1
+    sys.stdout.flush()
+    sys.stderr.flush()
+    return code
+
+def _on_alarm(signum, frame):
+    raise _Timeout()
+
+def _monitor(conn, fds, request):
+    """Runs in a forked child per submission, supervises the script process"""
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    pid = os.fork()
+    if pid == 0:
+        # Own session, so the whole process tree of the script can be killed at once
+        os.setsid()
+        conn.close()
+        for target, fd in enumerate(fds):
+            os.dup2(fd, target)
+            os.close(fd)
+        os._exit(_run_script(request["script"]))
+
+    for fd in fds:
+        os.close(fd)
+    signal.signal(signal.SIGALRM, _on_alarm)
+    signal.alarm(int(request.get("timeout", 30)))
+    try:
+        _, status = os.waitpid(pid, 0)
+        signal.alarm(0)
+        code = os.waitstatus_to_exitcode(status)
+        if code < 0:
+            code = 128 - code   # killed by a signal, report it like a shell does
+    except _Timeout:
+        code = TIMEOUT_EXIT_CODE
+    # Kill whatever the script left behind, including the script itself on timeout
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+    try:
+        os.waitpid(pid, 0)
+    except ChildProcessError:
+        pass
+    conn.sendall(f"{code}\n".encode())
+    conn.close()
+
+def serve():
+    _preload()
+    sys.stdout.flush()
+    sys.stderr.flush()
+    if os.path.exists(SOCKET_PATH):
+        os.unlink(SOCKET_PATH)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(SOCKET_PATH)
+    server.listen()
+    # Monitors are never waited for, let the kernel reap them
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    while True:
+        conn, _ = server.accept()
+        try:
+            message, fds, _, _ = socket.recv_fds(conn, 65536, 3)
+            request = json.loads(message)
+        except Exception as e:
+            print(f"runner: invalid request: {e}", file=sys.stderr)
+            conn.close()
+            continue
+        if os.fork() == 0:
+            server.close()
+            _monitor(conn, fds, request)
+            os._exit(0)
+        conn.close()
+        for fd in fds:
+            os.close(fd)
+
+def run(script, timeout):
+    # Every execution starts without results, also if the previous one was not cleaned up
+    try:
+        os.unlink(RESULTS_PATH)
+    except FileNotFoundError:
+        pass
+    try:
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        conn.connect(SOCKET_PATH)
+    except OSError:
+        # Runner is not up (yet), fall back to a cold interpreter
+        os.execvp("timeout", ["timeout", f"{timeout}s", sys.executable, script])
+    request = json.dumps({"script": script, "timeout": timeout}).encode()
+    socket.send_fds(conn, [request], [0, 1, 2])
+    response = b""
+    while chunk := conn.recv(64):
+        response += chunk
+    # An empty response means the runner died while supervising the script
+    sys.exit(int(response) if response.strip() else RUNNER_FAILURE_EXIT_CODE)
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["--serve"]:
+        serve()
+    else:
+        run(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 30)
@@ -0,0 +1,89 @@
+# Direct rendering of stormpy sparse models (SparseDtmc, SparseMdp, SparseCtmc, ...)
+#
+# Converting a stormpy model to stormvogel builds a Python object per state, transition and
+# result, which is O(model) in pure Python. The ModelGraph built here reads the transition
+# matrix and the labeling lazily, only for the states that are drawn, and keeps the results
+# in a numpy array, so statistics and the states with the highest results are vectorized.
+import numpy
+
+import large_models
+
+TOP_STATES = 10
+
+def result_values(model, result):
+    """The results of all states as a float array, None if the result has no explicit value per state"""
+    if hasattr(result, "get_values"):
+        values = result.get_values()
+    elif hasattr(result, "get_truth_values"):
+        truth = result.get_truth_values()
+        values = [truth.get(state) for state in range(model.nr_states)]
+    else:
+        return None
+    try:
+        return numpy.asarray(values, dtype=float)
+    except (TypeError, ValueError):
+        return None     # e.g. parametric results (rational functions)
+
+def array_statistics(values):
+    """value_statistics of a float array, computed by numpy"""
+    numbers = values[~numpy.isnan(values)]
+    if numbers.size == 0:
+        return None
+    return {"count": int(numbers.size), "min": float(numbers.min()), "max": float(numbers.max()),
+            "mean": float(numbers.mean())}
+
+def top_states(values, k, candidates=None):
+    """The k states with the highest result, highest first, optionally only among candidates"""
+    candidates = numpy.arange(values.size) if candidates is None else numpy.asarray(candidates, dtype=numpy.int64)
+    scores = numpy.nan_to_num(values[candidates], nan=-numpy.inf)
+    k = min(k, candidates.size)
+    if k == 0:
+        return []
+    # All states that reach the k-th highest score, so ties at the cut keep the order of the states
+    threshold = numpy.partition(scores, scores.size - k)[scores.size - k]
+    best = numpy.flatnonzero(scores >= threshold)
+    best = best[numpy.argsort(-scores[best], kind="stable")][:k]
+    return candidates[best].tolist()
+
+def states_with_label(model, label):
+    return numpy.fromiter(model.labeling.get_states(label), dtype=numpy.int64)
+
+def model_graph(model, values=None):
+    """Describe a stormpy sparse model (and its results) for large_models.render"""
+    matrix = model.transition_matrix
+    nondeterministic = model.is_nondeterministic_model
+    choice_labeling = model.choice_labeling if nondeterministic and model.has_choice_labeling() else None
+
+    def successors(state):
+        if nondeterministic:
+            start, end = matrix.get_row_group_start(state), matrix.get_row_group_end(state)
+        else:
+            start, end = state, state + 1
+        transitions = []
+        for row in range(start, end):
+            if choice_labeling is not None:
+                action = ",".join(sorted(choice_labeling.get_labels_of_choice(row)))
+            else:
+                action = str(row - start) if nondeterministic else ""
+            transitions += [(action, entry.value(), entry.column) for entry in matrix.get_row(row)]
+        return transitions
+
+    labeling = model.labeling
+    label_counts = {label: labeling.get_states(label).number_of_set_bits() for label in labeling.get_labels()}
+    return large_models.ModelGraph(
+        model.model_type.name, model.nr_states, model.nr_transitions, list(model.initial_states), successors,
+        lambda state: sorted(labeling.get_labels_of_state(state)), label_counts,
+        (lambda state: float(values[state])) if values is not None else None,
+        array_statistics(values) if values is not None else None)
+
+def render(model, result=None, top_k=TOP_STATES, label=None, around=None,
+           subgraph_states=large_models.SUBGRAPH_STATES):
+    """The summary document of a stormpy model. With a result, the top_k states with the highest
+    result are listed. label restricts that list, and the drawn subgraph, to the states with the label."""
+    values = result_values(model, result) if result is not None else None
+    graph = model_graph(model, values)
+    candidates = states_with_label(model, label) if label is not None else None
+    if around is None and candidates is not None:
+        around = candidates[:subgraph_states].tolist()
+    best = top_states(values, top_k, candidates) if values is not None and top_k else None
+    return large_models.render(graph, around, subgraph_states, best), large_models.summary(graph)
@@ -0,0 +1,57 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+# Cache key of an execution: the image it runs on plus the script and every tab
+def result_key(image_digest, code, tabs=None):
+    digest = hashlib.sha256()
+    for part in (image_digest, "script.py", code, *(item for name in sorted(tabs or {}) for item in (name, tabs[name]))):
+        digest.update(part.encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+class ResultCache:
+    """Least recently used execution results, holding at most max_bytes of (JSON encoded) results"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()    # key -> (result, size), least recently used first
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return dict(entry[0])
+
+    def put(self, key, result):
+        size = len(json.dumps(result))
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self.entries[key] = (dict(result), size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.bytes -= evicted
+
+    def metrics(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
@@ -1,86 +1,284 @@
+import asyncio
 import docker
+import hashlib
+import json
 import logging
+import math
 import re
 import io
 import tarfile
-import subprocess
+import tempfile
+import struct
 import threading
 import time
-from datetime import datetime, timedelta
+import os
+import posixpath
+import uuid
+from collections import Counter
+from contextlib import asynccontextmanager
+from registry import SharedRegistry
+from records import Record, parse_records
+from result_cache import ResultCache, result_key
+from linter import Linter
+from pool import SandboxPool, parse_pool_sizes, POOL_PREFIX, POOL_LABEL
+from scheduler import ExecutionQueue, ExecutionSlots, QueueBusy, RateLimiter
+from service import SandboxService
 
 logging.basicConfig(level=logging.WARNING)
 logger = logging.getLogger(__name__)
 
 client = docker.from_env()
 
+IMAGE_TAGS = ("latest", "nightly", "experimental")
+SANDBOX_LABEL = "stormvogel.sandbox"
+RESOURCES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "resources")
+# Time limit (seconds) for a single execution inside the sandbox, and for the docker exec around it
+EXECUTION_TIMEOUT = 30
+EXTERNAL_TIMEOUT = 40
+# How long (seconds) to wait for Docker to record the exit code of an exec whose output ended
+EXEC_INSPECT_TIMEOUT = 5
+# Output bytes per execution that are kept in memory, returned inline and streamed. Beyond that
+# the whole output is spilled to a file that can be downloaded, up to the output limit.
+OUTPUT_INLINE_LIMIT = int(os.environ.get("SANDBOX_OUTPUT_INLINE_LIMIT", str(4 * 1024 * 1024)))
+OUTPUT_LIMIT = int(os.environ.get("SANDBOX_OUTPUT_LIMIT", str(64 * 1024 * 1024)))
+# Directory for spilled outputs, which are removed after OUTPUT_TTL seconds
+OUTPUT_DIR = os.environ.get("SANDBOX_OUTPUT_DIR", os.path.join(tempfile.gettempdir(), "stormvogel-outputs"))
+OUTPUT_TTL = int(os.environ.get("SANDBOX_OUTPUT_TTL", "600"))
+OUTPUT_CHUNK = 64 * 1024
+# File the visualizations of show() are written to as framed records (see records.py),
+# and the largest one that is read back after an execution
+RESULTS_PATH = "/tmp/playground-results"
+RESULTS_LIMIT = int(os.environ.get("SANDBOX_RESULTS_LIMIT", str(64 * 1024 * 1024)))
+# Directory for the visualizations of executions (artifacts), which are fetched separately
+# from the result. Files are named by their content hash and removed ARTIFACT_TTL seconds
+# after an execution produced them last.
+ARTIFACT_DIR = os.environ.get("SANDBOX_ARTIFACT_DIR", os.path.join(tempfile.gettempdir(), "stormvogel-artifacts"))
+ARTIFACT_TTL = int(os.environ.get("SANDBOX_ARTIFACT_TTL", "3600"))
+# Artifact file extension per MIME type, the extension determines how an artifact is served
+ARTIFACT_EXTENSIONS = {"text/html": "html", "image/png": "png", "image/gif": "gif", "image/jpeg": "jpg",
+                       "image/svg+xml": "svg", "image/webp": "webp"}
+# Marker file whose mtime is the time of the last upload to a container
+UPLOAD_STAMP = ".upload-stamp"
+# Cheap in-place reset after a normal execution: the runner already killed the script's
+# process group, so remove temporary files, list uploaded files the script modified or
+# removed (the uploaded paths are passed as arguments) and check that the runner is still alive
+RESET_COMMAND = (
+    "rm -rf /tmp/* /tmp/.[!.]* 2>/dev/null; "
+    f"find /script.py /app -type f -newer /{UPLOAD_STAMP} 2>/dev/null; "
+    'for path in "$@"; do test -e "/$path" || echo "/$path"; done; '
+    "pgrep -f '[r]unner.py --serve' > /dev/null || exit 3"
+)
+RUNNER_DOWN_EXIT_CODE = 3
+# Number of idle pre-started containers kept per tag, e.g. "latest=1,nightly=2,experimental=1".
+# They count towards MAX_SANDBOXES.
+POOL_SIZES = parse_pool_sizes(os.environ.get("SANDBOX_POOL_SIZES", "latest=0,nightly=1,experimental=0"), IMAGE_TAGS)
+# How long (seconds) and how many requests per user may wait for an earlier execution
+EXECUTION_QUEUE_WAIT = float(os.environ.get("EXECUTION_QUEUE_WAIT", "60"))
+EXECUTION_QUEUE_LENGTH = int(os.environ.get("EXECUTION_QUEUE_LENGTH", "4"))
+# Global limits: executions running at once over all worker processes, requests waiting for
+# one of those slots, and sandboxes alive at the same time, idle pool containers included.
+# Each sandbox may use up to 512 MB, 6 of them leave room for the backend on a 4 GB host.
+MAX_EXECUTIONS = int(os.environ.get("SANDBOX_MAX_EXECUTIONS", "4"))
+MAX_WAITING_EXECUTIONS = int(os.environ.get("SANDBOX_MAX_WAITING_EXECUTIONS", "32"))
+MAX_SANDBOXES = int(os.environ.get("SANDBOX_MAX_SANDBOXES", "6"))
+# A place reserved for a new sandbox (or pool container) is given up after this many seconds
+# if the worker that reserved it dies before the container is running
+SANDBOX_RESERVATION_TIMEOUT = 120
+# An execution slot or turn in the registry that is held longer than this (seconds) belonged
+# to a worker that died, and how long to wait before asking for a free one again
+EXECUTION_SLOT_STALE = 4 * EXTERNAL_TIMEOUT
+EXECUTION_SLOT_POLL = 0.05
+# Requests per second each user may make on average, and how many they may make in a burst
+RATE_LIMIT = float(os.environ.get("SANDBOX_RATE_LIMIT", "0.5"))
+RATE_BURST = float(os.environ.get("SANDBOX_RATE_BURST", "10"))
+# The editor lints after every pause in typing, so a lint takes only part of a token
+LINT_REQUEST_COST = 0.25
+# ruff processes that may run at once on the host
+LINT_PROCESSES = int(os.environ.get("LINT_PROCESSES", "4"))
+# Seconds a lint waits before ruff starts, a newer lint of the same user within that time replaces it
+LINT_COALESCE_DELAY = float(os.environ.get("LINT_COALESCE_DELAY", "0.1"))
+# Bytes of successful execution results kept to answer identical executions, 0 disables the cache
+RESULT_CACHE_BYTES = int(os.environ.get("SANDBOX_RESULT_CACHE_BYTES", "0"))
+# How long (seconds) the image a tag points to is remembered, nightly images are replaced regularly
+IMAGE_DIGEST_TTL = 300
+# Threads for blocking Docker SDK calls, executions themselves are awaited on the event loop
+SERVICE_THREADS = int(os.environ.get("SANDBOX_SERVICE_THREADS", "16"))
+# Sandboxes are removed after this many seconds without use, and at the latest after the max lifetime
+IDLE_TTL = float(os.environ.get("SANDBOX_IDLE_TTL", "1800"))
+MAX_LIFETIME = float(os.environ.get("SANDBOX_MAX_LIFETIME", "7200"))
+# SQLite file holding the registry, shared by all worker processes of the backend on this host
+REGISTRY_PATH = os.environ.get("SANDBOX_REGISTRY_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "sandboxes.sqlite3"))
+# Longest time (seconds) a reaper sleeps, so it notices sandboxes registered by other workers
+REAPER_POLL_INTERVAL = 30
+
+SANDBOX_PREFIX = "sandbox_"
+
 class ContainerManager:
-    def __init__(self):
-        self.container_timestamps = {}
-        self.cleanup_thread = threading.Thread(target=self._periodic_cleanup, daemon=True)
-        self.cleanup_thread.start()
-    
-    def register_container(self, user_id):
-        """Register when a container was created/accessed"""
-        self.container_timestamps[user_id] = datetime.now()
-    
-    def _periodic_cleanup(self):
-        """Clean up containers older than 1 hour"""
+    """Registry of the user sandboxes, shared by all backend worker processes.
+
+    Maps user_id to container id, image tag, state, creation and last-used time, so requests
+    resolve their container without asking the Docker daemon. The rows live in a SQLite
+    file (see registry.py), which every worker rebuilds from the container labels when it
+    starts and keeps in sync through the Docker events stream. Each worker runs a reaper that
+    sleeps until the earliest deadline, claiming an expired sandbox is atomic, so it is
+    removed exactly once.
+    """
+
+    def __init__(self, path=REGISTRY_PATH, idle_ttl=IDLE_TTL, max_lifetime=MAX_LIFETIME):
+        self.store = SharedRegistry(path, idle_ttl, max_lifetime)
+        self.max_lifetime = max_lifetime
+        self.deadline_changed = threading.Condition()
+        self.events_thread = None
+        self.reaper_thread = None
+
+    def start(self):
+        """Rebuild the registry, then follow Docker events and reap expired sandboxes in the background"""
+        self.rebuild()
+        self.events_thread = threading.Thread(target=self._watch_events, daemon=True)
+        self.events_thread.start()
+        self.reaper_thread = threading.Thread(target=self._reap_expired, daemon=True)
+        self.reaper_thread.start()
+
+    def rebuild(self):
+        """Reindex all labelled sandbox containers that belong to a user"""
+        listed_at = time.time()
+        try:
+            containers = client.containers.list(all=True, filters={"label": SANDBOX_LABEL})
+        except Exception as e:
+            logger.error("Failed to rebuild container registry: %s", e)
+            return
+        sandboxes = {}
+        for container in containers:
+            user_id = self._user_for_name(container.name)
+            if user_id is not None:
+                sandboxes[container.id] = user_id
+                self.store.put(user_id, container.id, container.name, container.labels.get(SANDBOX_LABEL),
+                               container.status, since=listed_at)
+        self.store.prune(set(sandboxes), listed_at)
+        self._deadline_changed()
+        logger.info("Container registry holds %d sandboxes", len(sandboxes))
+
+    @staticmethod
+    def _user_for_name(name):
+        if not name.startswith(SANDBOX_PREFIX) or name.startswith(POOL_PREFIX):
+            return None
+        return name[len(SANDBOX_PREFIX):]
+
+    def _deadline_changed(self):
+        with self.deadline_changed:
+            self.deadline_changed.notify()
+
+    def register_container(self, user_id, container, tag):
+        """Register a container that was created or claimed for the user"""
+        self.store.put(user_id, container.id, f"{SANDBOX_PREFIX}{user_id}", tag, "running")
+        self._deadline_changed()
+
+    def touch(self, user_id):
+        """Mark the user's sandbox as used, which pushes back its idle deadline"""
+        self.store.touch(user_id)
+
+    def unregister_container(self, user_id):
+        self.store.remove(user_id)
+
+    def lookup(self, user_id):
+        """Registry entry of the user, or None"""
+        return self.store.get(user_id)
+
+    def get_container(self, user_id):
+        """Container model for the user's sandbox, built without a daemon round trip"""
+        entry = self.lookup(user_id)
+        if entry is None:
+            raise docker.errors.NotFound(f"No sandbox registered for user {user_id}")
+        return self._container_model(entry)
+
+    @staticmethod
+    def _container_model(entry):
+        return client.containers.prepare_model({
+            "Id": entry["container_id"],
+            "Name": f"/{entry['name']}",
+            "State": {"Status": entry["state"]},
+            "Config": {"Labels": {SANDBOX_LABEL: entry["tag"]}},
+        })
+
+    def _watch_events(self):
+        """Follow container start/die/destroy events, resync after reconnecting"""
         while True:
             try:
-                current_time = datetime.now()
-                expired_users = []
-                
-                for user_id, timestamp in self.container_timestamps.items():
-                    if current_time - timestamp > timedelta(hours=1):
-                        expired_users.append(user_id)
-                
-                for user_id in expired_users:
-                    self._force_cleanup_container(user_id)
-                    del self.container_timestamps[user_id]
-                
-                time.sleep(300)
+                events = client.events(decode=True, filters={"type": "container", "label": SANDBOX_LABEL})
+                for event in events:
+                    self._apply_event(event)
             except Exception as e:
-                logger.error("Periodic cleanup failed: %s", e)
+                logger.warning("Docker events stream failed: %s", e)
+            time.sleep(1)
+            self.rebuild()
+
+    def _apply_event(self, event):
+        # Every worker applies the same events, the updates are idempotent
+        action = event.get("Action", "")
+        actor = event.get("Actor", {})
+        container_id = actor.get("ID") or event.get("id")
+        attributes = actor.get("Attributes", {})
+        if action == "start":
+            if not self.store.set_state(container_id, "running"):
+                # Sandboxes created outside the registry show up once they start
+                user_id = self._user_for_name(attributes.get("name", ""))
+                if user_id is not None:
+                    self.store.put(user_id, container_id, attributes["name"], attributes.get(SANDBOX_LABEL), "running")
+                    self._deadline_changed()
+        elif action == "die":
+            self.store.set_state(container_id, "exited")
+        elif action == "destroy":
+            self.store.remove_container(container_id)
+
+    def _next_expired(self):
+        """Block until some sandbox reaches its deadline, returns its (claimed) registry entry"""
+        while True:
+            entry = self.store.claim_expired()
+            if entry is not None:
+                return entry
+            deadline = self.store.next_deadline()
+            timeout = REAPER_POLL_INTERVAL if deadline is None else deadline - time.time()
+            with self.deadline_changed:
+                self.deadline_changed.wait(max(0, min(timeout, REAPER_POLL_INTERVAL)))
+
+    def _reap_expired(self):
+        """Remove sandboxes as soon as they are idle for too long or reach their max lifetime"""
+        while True:
+            try:
+                entry = self._next_expired()
+                logger.info("Sandbox of user %s expired", entry["user_id"])
+                self._force_cleanup_container(entry)
+            except Exception as e:
+                logger.error("Reaping expired sandbox failed: %s", e)
+                time.sleep(1)
+
+    def metrics(self):
+        counts = self.store.counts()
+        return {"sandboxes": sum(counts.values()), "running": counts.get("running", 0)}
     
-    def _force_cleanup_container(self, user_id):
-        """Force cleanup a specific container"""
-        container_name = f"sandbox_{user_id}"
+    def _force_cleanup_container(self, entry):
+        """Force cleanup a specific (already unregistered) container"""
         try:
-            container = client.containers.get(container_name)
+            container = self._container_model(entry)
             container.stop(timeout=1)
             container.remove()
-            logger.info("Force cleaned up container for user %s", user_id)
+            logger.info("Force cleaned up container for user %s", entry["user_id"])
         except docker.errors.NotFound:
             pass  # Container already gone
         except Exception as e:
-            logger.error("Failed to force cleanup container for %s: %s", user_id, e)
+            logger.error("Failed to force cleanup container for %s: %s", entry["user_id"], e)
+        _forget_container(entry["container_id"])
 
 container_manager = ContainerManager()
 
-# Either reuses an existing container or creates a new one
-def start_sandbox(user_id, tag="nightly"):
-    container_manager.register_container(user_id)
-    container_name = f"sandbox_{user_id}"
-    image = f"stormvogel/stormvogel:{tag}"
-    existing_containers = client.containers.list(filters={"name": container_name})
-    logger.info(existing_containers)
-
-    if existing_containers:
-        container = existing_containers[0]
-        # If the existing container uses a different image tag, stop and recreate it
-        if image not in (container.image.tags or []):
-            logger.info(f"Image tag mismatch for user {user_id}, recreating container with {image}")
-            container.stop(timeout=1)
-            container.remove()
-        else:
-            logger.info(f"Reusing container {container.id} for user {user_id}")
-            return container
-
-    container = client.containers.run(
-        image,
+# Starts a new gVisor sandbox container from the stormvogel image with the given tag
+def run_container(tag, name, labels=None):
+    return client.containers.run(
+        f"stormvogel/stormvogel:{tag}",
         runtime="runsc",
         detach=True,
-        name=container_name,
+        name=name,
+        labels={SANDBOX_LABEL: tag, **(labels or {})},
         stdin_open=True,
         tty=True,
         security_opt=["no-new-privileges"],
@@ -88,7 +286,230 @@ def start_sandbox(user_id, tag="nightly"):
         mem_limit="512m",
         command="sh",
     )
-    logger.info(f"Started new sandbox container {container.id} for user {user_id}")
+
+# Reads a helper file that is shipped into the sandbox
+def _read_resource(filename):
+    with open(os.path.join(RESOURCES_DIR, filename), "r", encoding="utf-8") as f:
+        return f.read()
+
+# Helper modules installed once per container, read from disk once per backend process
+HELPER_FILES = {filename: _read_resource(filename) for filename in
+                ("runner.py", "playground.py", "large_models.py", "stormpy_models.py")}
+HELPERS_DIGEST = hashlib.sha256(
+    "".join(f"{name}\0{content}\0" for name, content in sorted(HELPER_FILES.items())).encode()
+).hexdigest()
+HELPERS_DIGEST_FILE = "helpers.sha256"
+# Digest of the helpers installed in each container (by id) as far as this process knows
+helper_versions = {}
+helper_versions_lock = threading.Lock()
+
+# Starts the persistent runner, which pre-imports stormvogel/stormpy and forks per execution.
+# The helper modules are (re)installed first and a runner from an older version is replaced.
+# Executions fall back to a cold python3 until the runner is listening.
+def start_runner(container):
+    upload_files(container, {**HELPER_FILES, HELPERS_DIGEST_FILE: HELPERS_DIGEST})
+    # The [r] keeps pkill from matching the sh -c command line itself
+    container.exec_run(
+        ["sh", "-c", "pkill -f '[r]unner.py --serve'; exec python3 /runner.py --serve"], detach=True
+    )
+    with helper_versions_lock:
+        helper_versions[container.id] = HELPERS_DIGEST
+
+# Makes sure the container runs the current helper modules. Only containers this process
+# has not seen yet (e.g. adopted after a backend restart) cost a round trip to check.
+def ensure_helpers(container):
+    with helper_versions_lock:
+        installed = helper_versions.get(container.id)
+    if installed is None:
+        result = container.exec_run(["cat", f"/{HELPERS_DIGEST_FILE}"])
+        installed = result.output.decode().strip() if result.exit_code == 0 else ""
+    if installed != HELPERS_DIGEST:
+        logger.info(f"Installing updated helper modules in container {container.name}")
+        start_runner(container)
+    else:
+        with helper_versions_lock:
+            helper_versions[container.id] = installed
+
+# Starts an idle container that waits in the pool until a user claims it
+def _create_pool_container(tag):
+    name = f"{POOL_PREFIX}{tag}_{uuid.uuid4().hex[:12]}"
+    container = run_container(tag, name, labels={POOL_LABEL: tag})
+    start_runner(container)
+    return container
+
+sandbox_pool = SandboxPool(_create_pool_container, POOL_SIZES, container_manager.store, client=client,
+                           limit=MAX_SANDBOXES, reservation_timeout=SANDBOX_RESERVATION_TIMEOUT)
+service = SandboxService(max_workers=SERVICE_THREADS)
+execution_queue = ExecutionQueue(max_wait=EXECUTION_QUEUE_WAIT, max_length=EXECUTION_QUEUE_LENGTH)
+execution_slots = ExecutionSlots(MAX_EXECUTIONS, max_waiting=MAX_WAITING_EXECUTIONS, max_wait=EXECUTION_QUEUE_WAIT)
+rate_limiter = RateLimiter(RATE_LIMIT, RATE_BURST, store=container_manager.store)
+linter = Linter(max_processes=LINT_PROCESSES, coalesce_delay=LINT_COALESCE_DELAY)
+result_cache = ResultCache(RESULT_CACHE_BYTES) if RESULT_CACHE_BYTES > 0 else None
+background_started = False
+background_lock = threading.Lock()
+
+# Starts the registry sync, the reaper and the pool refill threads. Only the server calls
+# this, scripts and tests that import this module do not start (pool) containers.
+def start_background():
+    global background_started
+    with background_lock:
+        if background_started:
+            return
+        background_started = True
+    container_manager.start()
+    sandbox_pool.start()
+
+# Image id per tag as (id, time it was looked up)
+image_digests = {}
+image_digests_lock = threading.Lock()
+# How often containers were reset in place or restarted (per fault) after use
+recycle_counters = Counter()
+recycle_counters_lock = threading.Lock()
+
+# Metrics exposed through the /api/metrics endpoint
+def metrics():
+    with recycle_counters_lock:
+        recycling = dict(recycle_counters)
+    return {
+        "pool": sandbox_pool.metrics(),
+        "execution_queue": service.on_loop(execution_queue.metrics),
+        "execution_slots": {**service.on_loop(execution_slots.metrics),
+                            "running_total": container_manager.store.running_executions()},
+        "lint": service.on_loop(linter.metrics),
+        "rate_limit": rate_limiter.metrics(),
+        "recycling": recycling,
+        "result_cache": result_cache.metrics() if result_cache is not None else None,
+        "sandboxes": container_manager.metrics(),
+        "service": service.metrics(),
+    }
+
+# Configured limits and current queue depths, for the admin endpoint
+def scheduler_status():
+    def on_loop():
+        return {
+            "execution_slots": execution_slots.metrics(),
+            "max_waiting_executions": execution_slots.max_waiting,
+            "execution_queue": execution_queue.metrics(),
+            "max_queued_per_user": execution_queue.max_length,
+        }
+    return {
+        **service.on_loop(on_loop),
+        "rate_limit": rate_limiter.metrics(),
+        "sandboxes": {**container_manager.metrics(), "idle_pool": sandbox_pool.idle_count(), "limit": MAX_SANDBOXES},
+    }
+
+def _count_recycle(kind):
+    with recycle_counters_lock:
+        recycle_counters[kind] += 1
+
+# Maps an execution exit code to the fault that requires a container restart, if any.
+# An unknown exit code (None) is treated as a crash.
+def _fault_for_exit_code(exit_code):
+    if exit_code is None:
+        return "crash"
+    if exit_code == 124:
+        return "timeout"
+    if exit_code == 137:    # SIGKILL, in practice the memory limit
+        return "oom"
+    if exit_code == 125 or exit_code > 128:
+        return "crash"
+    return None
+
+# Brings a container back to a clean state after an execution or lint.
+# Only a fault (timeout, OOM, crash, failed health check) pays for a full restart.
+def recycle_container(container, fault=None):
+    try:
+        if fault is None:
+            try:
+                uploaded = sorted(container_manager.store.uploads(container.id))
+                result = container.exec_run(["sh", "-c", RESET_COMMAND, "reset", *uploaded])
+                # Files the script changed or removed have to be uploaded again next time
+                modified = [path.lstrip("/") for path in result.output.decode().splitlines() if path]
+                forget_uploads(container.id, modified)
+                if result.exit_code == 0:
+                    _count_recycle("reset")
+                    return
+                if result.exit_code == RUNNER_DOWN_EXIT_CODE:
+                    start_runner(container)
+                    _count_recycle("reset")
+                    return
+                fault = "unhealthy"
+            except docker.errors.APIError as e:
+                logger.warning(f"Reset of container {container.name} failed: {e}")
+                fault = "unhealthy"
+
+        logger.info(f"Restarting container {container.name} after fault: {fault}")
+        _count_recycle(f"restart_{fault}")
+        forget_uploads(container.id)
+        container.restart(timeout=0)
+        start_runner(container)
+    except Exception as e:
+        logger.error(f"Failed to recycle container {container.name}: {e}")
+
+# Error response for a request that did not get its turn in the user's execution queue
+def _queue_busy_response(error):
+    response = {
+        "status": "error",
+        "message": f"{error}, {error.position} execution(s) ahead of this one",
+        "queue_position": error.position,
+    }
+    if error.retry_after is not None:
+        response["retry_after"] = error.retry_after
+    return response
+
+# Error for a new sandbox when the host already runs the maximum number of them.
+# The retry hint is the time until the next sandbox expires.
+def _sandboxes_busy():
+    next_deadline = container_manager.store.next_deadline()
+    retry_after = max(1, math.ceil(next_deadline - time.time())) if next_deadline is not None else 60
+    return QueueBusy("Too many active sandboxes", retry_after=retry_after)
+
+# Creates a new sandbox for the user in a place reserved in the registry first, so concurrent
+# startups (of all worker processes) never run more than MAX_SANDBOXES containers
+def _create_sandbox(user_id, tag, container_name):
+    token = f"reserved_{uuid.uuid4().hex}"
+    if not container_manager.store.reserve_sandbox(user_id, token, container_name, tag, MAX_SANDBOXES,
+                                                   SANDBOX_RESERVATION_TIMEOUT):
+        raise _sandboxes_busy()
+    try:
+        container = run_container(tag, container_name)
+        start_runner(container)
+    except Exception:
+        container_manager.store.release_sandbox(user_id, token)
+        raise
+    return container
+
+# Either reuses an existing container, claims one from the warm pool or creates a new one
+def start_sandbox(user_id, tag="nightly"):
+    container_name = f"sandbox_{user_id}"
+    entry = container_manager.lookup(user_id)
+    logger.info(entry)
+
+    if entry is not None:
+        container = container_manager.get_container(user_id)
+        if entry["state"] == "running" and entry["tag"] == tag:
+            logger.info(f"Reusing container {container.id} for user {user_id}")
+            container_manager.register_container(user_id, container, tag)
+            container_manager.touch(user_id)
+            return container
+        # If the existing container uses a different image tag or is not running, recreate it
+        logger.info(f"Recreating container for user {user_id} with tag {tag}")
+        try:
+            container.remove(force=True)
+        except docker.errors.NotFound:
+            pass
+        container_manager.unregister_container(user_id)
+        _forget_container(container.id)
+
+    # A pool container is counted already, handing it out does not change the number of sandboxes
+    container = sandbox_pool.acquire(tag, container_name, user_id)
+    if container is not None:
+        logger.info(f"Claimed pool container {container.id} for user {user_id}")
+    else:
+        container = _create_sandbox(user_id, tag, container_name)
+        logger.info(f"Started new sandbox container {container.id} for user {user_id}")
+    container_manager.register_container(user_id, container, tag)
+    container_manager.store.mark_clean(container.id)
     return container
 
 # Matches HTML code, and separates it from the rest of the string
@@ -104,63 +525,432 @@ def separate_html(text):
 
     return html_content, non_html_content
 
-# Write code to a temporary file and send that to the container
-def write_to_file(filename, code, container):
-    tarstream = io.BytesIO()
-    with tarfile.TarFile(fileobj=tarstream, mode="w") as tar:
-        tarinfo = tarfile.TarInfo(filename)
-        tarinfo.size = len(code.encode())
-        tar.addfile(tarinfo, io.BytesIO(code.encode()))
+# Takes an HTML document the script printed out of its output, as a record. A document
+# without its closing tag stays in the output and gives no record.
+def _printed_html(output):
+    html_content, non_html_content = separate_html(output)
+    if html_content is None:
+        return None, non_html_content
+    return Record({"type": "html", "mime": "text/html"}, html_content.encode()), non_html_content
+
+# Reads the records show() wrote during the last execution. Returns them with a flag
+# that is False if the file exceeded RESULTS_LIMIT and was dropped.
+def read_results(container):
+    try:
+        stream, stat = container.get_archive(RESULTS_PATH)
+    except docker.errors.NotFound:
+        return [], True
+    if stat is not None and stat.get("size", 0) > RESULTS_LIMIT:
+        logger.warning(f"Dropping {stat['size']} bytes of results in container {container.name}")
+        return [], False
+    with tarfile.open(fileobj=io.BytesIO(b"".join(stream))) as tar:
+        member = tar.next()
+        data = tar.extractfile(member).read() if member is not None and member.isfile() else b""
+    return parse_records(data), True
+
+# Path of an artifact, its id is the sha256 of its content plus the file extension
+def artifact_path(artifact_id):
+    return os.path.join(ARTIFACT_DIR, artifact_id)
+
+def read_artifact(artifact_id):
+    with open(artifact_path(artifact_id), "rb") as f:
+        return f.read()
+
+# Stores the payload of a record as an artifact and returns its manifest entry,
+# or None if its MIME type cannot be served. Identical content is stored once.
+def _store_artifact(record):
+    extension = ARTIFACT_EXTENSIONS.get(record.mime)
+    if extension is None:
+        logger.debug(f"Ignoring {record.type} record of unsupported type {record.mime}")
+        return None
+    artifact_id = f"{hashlib.sha256(record.payload).hexdigest()}.{extension}"
+    path = artifact_path(artifact_id)
+    try:
+        os.utime(path)  # produced again, so it expires later
+    except FileNotFoundError:
+        os.makedirs(ARTIFACT_DIR, exist_ok=True)
+        # Written under a temporary name, so no request sees a partial file
+        temporary = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(temporary, "wb") as f:
+            f.write(record.payload)
+        os.replace(temporary, path)
+    entry = {"id": artifact_id, "type": record.type, "mime": record.mime, "size": len(record.payload)}
+    if "name" in record.description:
+        entry["name"] = record.description["name"]
+    return entry
 
+# True if all artifacts of a (cached) result can still be fetched, they are kept for another ARTIFACT_TTL
+def _artifacts_available(artifacts):
+    try:
+        for artifact in artifacts:
+            os.utime(artifact_path(artifact["id"]))
+    except FileNotFoundError:
+        return False
+    return True
+
+# Turns records into the manifest of the stored artifacts (visualizations and images),
+# the text shown below the output and the metadata that is passed on as is
+def _store_results(records):
+    artifacts, texts, metadata = [], [], []
+    for record in records:
+        if record.type in ("html", "image"):
+            entry = _store_artifact(record)
+            if entry is not None:
+                artifacts.append(entry)
+        elif record.type == "text":
+            texts.append(record.text())
+        else:
+            try:
+                metadata.append(json.loads(record.payload))
+            except ValueError:
+                logger.debug(f"Ignoring invalid metadata record {record.payload[:100]!r}")
+    return artifacts, texts, metadata
+
+# Sends files (path relative to / -> content) to the container in a single archive.
+# Files whose content did not change since the last upload are skipped, so an upload
+# where nothing changed costs no Docker API call at all.
+def upload_files(container, files):
+    hashes = {path: hashlib.sha256(content.encode()).hexdigest() for path, content in files.items()}
+    known = container_manager.store.uploads(container.id)
+    changed = [path for path in files if known.get(path) != hashes[path]]
+    if not changed:
+        return True
+
+    tarstream = io.BytesIO()
+    with tarfile.open(fileobj=tarstream, mode="w") as tar:
+        for path in changed:
+            data = files[path].encode()
+            tarinfo = tarfile.TarInfo(path)
+            tarinfo.size = len(data)
+            tar.addfile(tarinfo, io.BytesIO(data))
+        # Uploaded files keep mtime 0, anything newer than the stamp was changed in the sandbox
+        stamp = tarfile.TarInfo(UPLOAD_STAMP)
+        stamp.mtime = time.time()
+        tar.addfile(stamp, io.BytesIO(b""))
     tarstream.seek(0)
-    logger.debug(f"file{tarstream}")
-    if container.put_archive("/", tarstream):
-        logger.debug("File transfer success")
-    else:
+
+    if not container.put_archive("/", tarstream):
         logger.debug("File transfer failure")
+        return False
+    logger.debug(f"Uploaded {changed} to container {container.name}")
+    container_manager.store.record_uploads(container.id, {path: hashes[path] for path in changed})
+    return True
 
-# Executes a specified file in the container and returns the result if succesful
-def execute_code(user_id, code):
-    container_name = f"sandbox_{user_id}"
-    
+# Drops the given paths (or everything) from the upload cache of a container
+def forget_uploads(container_id, paths=None):
+    container_manager.store.forget_uploads(container_id, paths)
+
+# Drops everything cached about a removed container
+def _forget_container(container_id):
+    forget_uploads(container_id)
+    with helper_versions_lock:
+        helper_versions.pop(container_id, None)
+
+# Maps tabs to their upload paths in /app, next to where the script runs
+def _tab_files(tabs):
+    files = {}
+    for tab_name, tab_content in (tabs or {}).items():
+        path = posixpath.normpath(posixpath.join("app", tab_name))
+        if not path.startswith("app/"):
+            logger.warning(f"Ignoring tab with invalid name {tab_name!r}")
+            continue
+        files[path] = tab_content
+    return files
+
+class OutputCollector:
+    """Keeps the first max_inline bytes of output in memory and passes their non-HTML lines to on_output.
+    Once the output grows beyond that, all of it (up to max_output bytes) goes to the spill file instead."""
+
+    def __init__(self, on_output=None, max_output=OUTPUT_LIMIT, max_inline=OUTPUT_INLINE_LIMIT, spill_path=None):
+        self.on_output = on_output
+        self.max_output = max_output
+        self.max_inline = max_inline
+        self.spill_path = spill_path
+        self.spill = None
+        self.chunks = []
+        self.size = 0
+        self.truncated = False      # not all output is in memory
+        self.complete = True        # no output was dropped (the spill file has all of it)
+        self.in_html = False
+        self.html_start = None      # index in chunks where the unfinished HTML document starts
+        self.pending = b""
+
+    def feed(self, data):
+        if self.truncated:
+            # Lines only matter for the output kept in memory, the rest is written frame by frame
+            self._overflow(data)
+            return
+        self.pending += data
+        while self.pending and not self.truncated:
+            end = self.pending.find(b"\n") + 1
+            if end == 0:
+                # Wait for the rest of the line, unless it is getting too long
+                if len(self.pending) < OUTPUT_CHUNK:
+                    return
+                end = len(self.pending)
+            line, self.pending = self.pending[:end], self.pending[end:]
+            self._line(line)
+        if self.truncated and self.pending:
+            self._overflow(self.pending)
+            self.pending = b""
+
+    def close(self):
+        if self.pending:
+            self._line(self.pending)
+            self.pending = b""
+        if self.in_html and not self.truncated and self.on_output is not None:
+            # The document never ended, so it is plain output after all
+            for chunk in self.chunks[self.html_start:]:
+                self.on_output(chunk.decode(errors="replace"))
+        if self.spill is not None:
+            self.spill.close()
+
+    def _line(self, line):
+        if self.size + len(line) > self.max_inline:
+            self._overflow(line)
+            return
+        self.size += len(line)
+        self.chunks.append(line)
+        text = line.decode(errors="replace")
+        lowered = text.lower()
+        if not self.in_html and "<!doctype html>" in lowered:
+            self.in_html = True
+            self.html_start = len(self.chunks) - 1
+        if not self.in_html:
+            if self.on_output is not None:
+                self.on_output(text)
+        elif "</html>" in lowered:
+            self.in_html = False
+
+    def _overflow(self, data):
+        self.truncated = True
+        if not self.complete or self.size + len(data) > self.max_output:
+            # Drop everything from here on, but keep draining so the script does not block on a full pipe
+            self.complete = False
+            return
+        self.size += len(data)
+        if self.spill is None and self.spill_path is not None:
+            os.makedirs(os.path.dirname(self.spill_path), exist_ok=True)
+            self.spill = open(self.spill_path, "wb")
+            self.spill.writelines(self.chunks)
+        if self.spill is not None:
+            self.spill.write(data)
+        else:
+            self.complete = False
+
+    def output(self):
+        chunks = self.chunks
+        if self.in_html and self.truncated:
+            # The HTML document was cut off, a partial document is of no use
+            chunks = chunks[:self.html_start]
+        return b"".join(chunks).decode(errors="replace")
+
+    def spilled(self):
+        return self.spill is not None
+
+# Splits Docker's multiplexed exec stream into payloads. Every frame has an 8 byte header:
+# the stream type, 3 padding bytes and the big-endian payload size.
+def _split_frames(buffer):
+    payloads = []
+    while len(buffer) >= 8:
+        size = struct.unpack(">L", buffer[4:8])[0]
+        if len(buffer) < 8 + size:
+            break
+        payloads.append(bytes(buffer[8:8 + size]))
+        del buffer[:8 + size]
+    return payloads
+
+# Runs a command in the container through the Docker exec API and returns its exit code.
+# The exec is created with the pooled API client, and its output socket is read
+# asynchronously on the service event loop and fed to the collector.
+async def _exec_streaming(container, command, collector, environment=None):
+    exec_id = (await service.blocking(
+        client.api.exec_create, container.id, command, stdout=True, stderr=True, environment=environment
+    ))["Id"]
+    raw = await service.blocking(client.api.exec_start, exec_id, socket=True)
+    sock = getattr(raw, "_sock", raw)
+    sock.setblocking(False)
+    buffer = bytearray()
     try:
-        container = client.containers.get(container_name)
+        while data := await service.loop.sock_recv(sock, OUTPUT_CHUNK):
+            buffer += data
+            for payload in _split_frames(buffer):
+                collector.feed(payload)
+    finally:
+        collector.close()
+        sock.close()
+    return await _exit_code(exec_id)
 
-        exec_results = container.exec_run("pgrep -fa python")
-        exec_output = exec_results.output.decode()
+# Exit code of a finished exec. Docker may not have recorded the exit yet when the output
+# socket closes, so it is asked again until the exec stopped running. None if it never says.
+async def _exit_code(exec_id, timeout=EXEC_INSPECT_TIMEOUT):
+    deadline = time.monotonic() + timeout
+    while True:
+        inspect = await service.blocking(client.api.exec_inspect, exec_id)
+        if not inspect.get("Running") and inspect.get("ExitCode") is not None:
+            return inspect["ExitCode"]
+        if time.monotonic() >= deadline:
+            logger.warning(f"Exec {exec_id} has no exit code after {timeout} seconds")
+            return None
+        await asyncio.sleep(0.05)
 
-        logger.debug(f"These processes are executing in container: {exec_output}")
-        while "script.py" in exec_output:
-            logger.debug(f"Different Python file running in container{exec_output}")
-            exec_results = container.exec_run("pgrep -fa python")
-            exec_output = exec_results.output.decode()
+# Runs /script.py through the runner and collects its combined stdout/stderr.
+# Output is passed on while the script is still running, and the runner client enforces
+# the time limit itself; the extra external deadline only catches a hanging exec.
+async def _run_script(container, collector):
+    command = ["python3", "/runner.py", "/script.py", str(EXECUTION_TIMEOUT)]
+    return await asyncio.wait_for(
+        _exec_streaming(container, command, collector, environment={"PYTHONUNBUFFERED": "1"}),
+        EXTERNAL_TIMEOUT,
+    )
+
+# Path of a spilled output, the name includes a hash of the user so only they can fetch it
+def output_path(user_id, output_id):
+    owner = hashlib.sha256(user_id.encode()).hexdigest()[:16]
+    return os.path.join(OUTPUT_DIR, f"{owner}-{output_id}.log")
+
+# Removes the files in a directory (spilled outputs, artifacts) that are older than ttl seconds
+def _remove_expired_files(directory, ttl):
+    cutoff = time.time() - ttl
+    try:
+        entries = list(os.scandir(directory))
+    except FileNotFoundError:
+        return
+    for entry in entries:
+        try:
+            if entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+        except FileNotFoundError:
+            pass
+
+# Executes a specified file in the container and returns the result if succesful,
+# executions of the same user wait for their turn in arrival order.
+# on_output(text) receives the output while the script is still running.
+# tabs (name -> content) are uploaded to /app together with the script.
+# use_cache=False skips the result cache, for scripts whose output is not deterministic
+def execute_code(user_id, code, tabs=None, use_cache=True, on_output=None):
+    return service.call(execute_code_async(user_id, code, tabs, use_cache, on_output=on_output))
+
+# Asks the registry for a lease with acquire() until it is granted, waiting a little longer
+# each time. Raises the error made by busy() when that takes longer than timeout seconds.
+async def _wait_for_lease(acquire, busy, timeout=None):
+    timeout = EXECUTION_QUEUE_WAIT if timeout is None else timeout
+    deadline = time.monotonic() + timeout
+    delay = EXECUTION_SLOT_POLL
+    while not await service.blocking(acquire):
+        if time.monotonic() + delay > deadline:
+            raise busy()
+        await asyncio.sleep(delay)
+        delay = min(2 * delay, 1.0)
+
+# Holds the execution turn of the user in the shared registry, so executions of one user run
+# one after the other even when their requests reach different worker processes.
+# execution_queue only orders the requests of this process.
+@asynccontextmanager
+async def shared_turn(user_id, timeout=None):
+    token = uuid.uuid4().hex
+    await _wait_for_lease(lambda: container_manager.store.acquire_turn(user_id, token, EXECUTION_SLOT_STALE),
+                          lambda: QueueBusy("Timed out waiting for earlier executions", 1), timeout)
+    try:
+        yield
+    finally:
+        await service.blocking(container_manager.store.release_turn, user_id, token)
+
+# Holds one of the MAX_EXECUTIONS execution slots in the shared registry, so the limit holds
+# for all worker processes together. execution_slots only orders the requests of this process.
+@asynccontextmanager
+async def shared_execution_slot(timeout=None):
+    token = uuid.uuid4().hex
+    await _wait_for_lease(lambda: container_manager.store.acquire_execution_slot(token, MAX_EXECUTIONS, EXECUTION_SLOT_STALE),
+                          lambda: QueueBusy("Timed out waiting for a free execution slot", MAX_EXECUTIONS,
+                                            execution_slots.retry_after()), timeout)
+    try:
+        yield
+    finally:
+        await service.blocking(container_manager.store.release_execution_slot, token)
+
+async def execute_code_async(user_id, code, tabs=None, use_cache=True, on_output=None):
+    cache_key = None
+    if result_cache is not None:
+        cache_key = await _result_cache_key(user_id, code, tabs)
+        cached = result_cache.get(cache_key) if use_cache and cache_key is not None else None
+        if cached is not None and await service.blocking(_artifacts_available, cached.get("artifacts", [])):
+            await service.blocking(container_manager.touch, user_id)
+            return {**cached, "cached": True}
+    try:
+        async with execution_queue.turn(user_id), shared_turn(user_id), execution_slots.slot(user_id), \
+                shared_execution_slot():
+            await service.blocking(container_manager.touch, user_id)
+            # Results are shared by all users, so only runs in a container that no user code has
+            # changed yet (helpers, site-packages, files in /app) may be cached
+            entry = await service.blocking(container_manager.lookup, user_id)
+            clean = entry is not None and await service.blocking(container_manager.store.take_clean,
+                                                                  entry["container_id"])
+            try:
+                result = await _execute_code(user_id, code, tabs, on_output)
+            finally:
+                await service.blocking(container_manager.touch, user_id)
+    except QueueBusy as e:
+        return _queue_busy_response(e)
+    # Errors may be caused by the sandbox itself (timeouts, crashes), only successes are kept
+    if cache_key is not None and clean and result["status"] == "success" and not result.get("truncated"):
+        result_cache.put(cache_key, result)
+    return result
+
+# Image id the tag pointed to recently, looked up in the Docker daemon at most every IMAGE_DIGEST_TTL
+def image_digest(tag):
+    with image_digests_lock:
+        digest, looked_up = image_digests.get(tag, (None, None))
+    if looked_up is not None and time.monotonic() - looked_up < IMAGE_DIGEST_TTL:
+        return digest
+    digest = client.images.get(f"stormvogel/stormvogel:{tag}").id
+    with image_digests_lock:
+        image_digests[tag] = (digest, time.monotonic())
+    return digest
+
+async def _result_cache_key(user_id, code, tabs):
+    entry = await service.blocking(container_manager.lookup, user_id)
+    if entry is None:
+        return None
+    try:
+        digest = await service.blocking(image_digest, entry["tag"])
+    except Exception as e:
+        logger.warning(f"Could not look up the image of tag {entry['tag']}: {e}")
+        return None
+    return result_key(digest, code, tabs)
+
+async def _execute_code(user_id, code, tabs=None, on_output=None):
+    container_name = f"sandbox_{user_id}"
+    
+    try:
+        container = await service.blocking(container_manager.get_container, user_id)
 
         logger.debug(f"Executing code for {user_id}: {repr(code)}")
         
-        write_to_file("script.py", code, container)
-
-        # Read the content from resources/playground.py and write it into the container
-        with open("resources/playground.py", "r", encoding="utf-8") as f:
-            playground_code = f.read()
-            write_to_file("playground.py", playground_code, container)
-
-        # Container.exec_run does not have an timeout, so we use subprocess here
-        # exec_result = container.exec_run(
-        #     ["timeout", "30", "python3", "/script.py"], 
-        #     stdout=True, stderr=True
-        # )
-        result = subprocess.run(
-            ["docker", "exec", container.name, "timeout", "30s", "python3", "/script.py"],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            timeout=40
-        )
-
-        output = result.stdout + result.stderr
-        exit_code = result.returncode
+        # playground.py and the runner are installed once per container, only updates are shipped
+        await service.blocking(ensure_helpers, container)
 
-        container.restart(timeout=0)
+        # Script and tabs go in one archive, unchanged files are not sent again
+        await service.blocking(upload_files, container, {"script.py": code, **_tab_files(tabs)})
+
+        # The runner client enforces the time limit and exits with 124 on timeout
+        output_id = uuid.uuid4().hex
+        collector = OutputCollector(on_output, spill_path=output_path(user_id, output_id))
+        exit_code = await _run_script(container, collector)
+        output, truncated = collector.output(), collector.truncated
+        if collector.spilled():
+            await service.blocking(_remove_expired_files, OUTPUT_DIR, OUTPUT_TTL)
+            output += f"\n[Output truncated after {OUTPUT_INLINE_LIMIT} bytes, download the full output]"
+        elif truncated:
+            output += f"\n[Output truncated after {OUTPUT_INLINE_LIMIT} bytes]"
+        spilled = {"output_id": output_id, "output_bytes": collector.size,
+                   "output_complete": collector.complete} if collector.spilled() else {}
+        # The results file is removed when the container is reset, so it is read first
+        results, results_complete = [], True
+        if exit_code == 0:
+            results, results_complete = await service.blocking(read_results, container)
+
+        await service.blocking(recycle_container, container, fault=_fault_for_exit_code(exit_code))
 
         if exit_code == 124:  # 124 is the exit code for bash timeout command
             logger.debug("Execution timed out!")
@@ -168,63 +958,58 @@ def execute_code(user_id, code):
 
         if exit_code == 0:
             logger.debug(f"Execution output: exit_code={exit_code}, output={output}")
-            # Separate output from debug information
-            iframe_html, logs = separate_html(output)
-            return {"status": "success", "output_html": iframe_html , "output_non_html": logs}
+            # Only scripts that print an HTML document themselves need the output to be searched
+            if collector.html_start is not None:
+                printed_html, output = _printed_html(output)
+                if printed_html is not None:
+                    results.insert(0, printed_html)
+            if results:
+                await service.blocking(_remove_expired_files, ARTIFACT_DIR, ARTIFACT_TTL)
+            artifacts, texts, metadata = await service.blocking(_store_results, results)
+            logs = "\n".join([output.strip(), *texts]).strip()
+            if not results_complete:
+                logs += f"\n[Visualizations dropped, they exceeded {RESULTS_LIMIT} bytes]"
+            # Only the manifest is returned, the artifacts are fetched when they are shown
+            return {"status": "success", "artifacts": artifacts, "metadata": metadata,
+                    "output_non_html": logs, "truncated": truncated, **spilled}
         else:
-            return {"status": "error", "message": f"Execution failed: {output}"}
+            return {"status": "error", "message": f"Execution failed: {output}", "truncated": truncated, **spilled}
 
     except docker.errors.NotFound:
         logger.error(f"Container {container_name} not found")
         return {"status": "error", "message": "Container not found"}
-    except subprocess.TimeoutExpired:
+    except asyncio.TimeoutError:
         logger.debug("External timeout triggered")
+        await service.blocking(recycle_container, container, fault="timeout")
         return {"status": "error", "message": "External timeout was triggered, abnormal termination"}
     except Exception as e:
         logger.error(f"Execution failed: {str(e)}")
         return {"status": "error", "message": f"Execution failed: {str(e)}"}
 
-# Similar to execute code but, uses ruff command to provide linting feedback for the file
+# Lints the code with ruff on the host and returns its diagnostics, results are remembered by code hash.
+# The user's sandbox is not touched, so linting neither waits for nor disturbs executions.
+# A newer lint of the same user supersedes this one, which then has status "superseded".
 def lint_code(user_id, code):
-    container_name = f"sandbox_{user_id}"
-    
-    try:
-        container = client.containers.get(container_name)
-
-        logger.debug(f"Linting code for {user_id}: {repr(code)}")
-        
-        # Use a heredoc to write the code, ensuring proper termination
-        file_path = "/script.py"
-        write_to_file(code, container)
-        
-        # Run Ruff with the correct file path
-        exec_result = container.exec_run(["ruff", "check", "--no-fix", file_path], stdout=True, stderr=True)
-        output = exec_result.output.decode()
-        logger.debug(f"Linting output: exit_code={exec_result.exit_code}, output={output}")
+    return service.call(lint_code_async(user_id, code))
 
-        container.restart(timeout=0)
-
-        if exec_result.exit_code == 0:
-            return {"status": "success", "lint_output": output.strip()}
-        else:
-            return {"status": "error", "message": output}
-    except docker.errors.NotFound:
-        logger.error(f"Container {container_name} not found")
-        return {"status": "error", "message": "Container not found"}
-    except Exception as e:
-        logger.error(f"Linting failed: {str(e)}")
-        return {"status": "error", "message": f"Linting failed: {str(e)}"}
+async def lint_code_async(user_id, code):
+    logger.debug(f"Linting code for {user_id}: {repr(code)}")
+    await service.blocking(container_manager.touch, user_id)
+    return await linter.lint_latest(user_id, code)
 
 # Stops the container and removes it
 def stop_sandbox(user_id):
     container_name = f"sandbox_{user_id}"
     try:
-        container = client.containers.get(container_name)
+        container = container_manager.get_container(user_id)
         container.stop(timeout=1)
         container.remove()
+        container_manager.unregister_container(user_id)
+        _forget_container(container.id)
         logger.info(f"Sandbox {container_name} stopped and removed.")
         return True
     except docker.errors.NotFound:
+        container_manager.unregister_container(user_id)
         logger.warning(f"Sandbox {container_name} not found.")
         return False
 
@@ -233,19 +1018,13 @@ def save_tabs(user_id, tabs):
     container_name = f"sandbox_{user_id}"
 
     try:
-        container = client.containers.get(container_name)
-
-        # Create a tar archive of the tabs data
-        tarstream = io.BytesIO()
-        with tarfile.open(fileobj=tarstream, mode='w') as tar:
-            for tab_name, tab_content in tabs.items():
-                tab_info = tarfile.TarInfo(name=tab_name)  
-                tab_info.size = len(tab_content.encode())
-                tar.addfile(tab_info, io.BytesIO(tab_content.encode()))
-        tarstream.seek(0)
-
-        # Transfer the tar archive to the container, save it in the same directory as the script
-        if container.put_archive("/app", tarstream):
+        container = container_manager.get_container(user_id)
+        container_manager.touch(user_id)
+        # Saved tabs stay in /app next to the tabs of later executions, which the cache key does not cover
+        container_manager.store.take_clean(container.id)
+
+        # Transfer the tabs to the container, save them in the same directory as the script
+        if upload_files(container, _tab_files(tabs)):
             logger.debug(f"Tabs saved successfully in container {container_name}")
             return {"status": "success", "message": "Tabs saved successfully"}
         else:
@@ -0,0 +1,218 @@
+import asyncio
+import heapq
+import math
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+class QueueBusy(Exception):
+    """Raised when a request could not get its turn within the allowed bounds"""
+
+    def __init__(self, message, position=None, retry_after=None):
+        super().__init__(message)
+        self.position = position
+        self.retry_after = retry_after   # seconds after which a retry is likely to be admitted
+
+class ExecutionQueue:
+    """Serializes work per user in arrival order without polling the sandbox.
+    Only used from the sandbox service event loop, so it needs no locking."""
+
+    def __init__(self, max_wait=60, max_length=4):
+        self.max_wait = max_wait
+        self.max_length = max_length
+        self.queues = {}    # user_id -> deque of futures, the head future holds the turn
+
+    @asynccontextmanager
+    async def turn(self, user_id, timeout=None):
+        """Wait (at most timeout seconds) until every earlier request of this user finished"""
+        timeout = self.max_wait if timeout is None else timeout
+        queue = self.queues.setdefault(user_id, deque())
+        if len(queue) >= self.max_length:
+            raise QueueBusy("Too many pending executions", len(queue))
+        ticket = asyncio.get_running_loop().create_future()
+        queue.append(ticket)
+        if queue[0] is ticket:
+            ticket.set_result(None)
+        try:
+            await asyncio.wait_for(asyncio.shield(ticket), timeout)
+        except asyncio.TimeoutError:
+            position = queue.index(ticket)
+            self._leave(user_id, ticket)
+            raise QueueBusy("Timed out waiting for earlier executions", position)
+        except BaseException:
+            self._leave(user_id, ticket)
+            raise
+        try:
+            yield
+        finally:
+            self._leave(user_id, ticket)
+
+    def _leave(self, user_id, ticket):
+        queue = self.queues[user_id]
+        queue.remove(ticket)
+        if not queue:
+            del self.queues[user_id]
+        elif not queue[0].done():
+            queue[0].set_result(None)
+
+    def position(self, user_id):
+        """Number of requests of this user that are running or waiting"""
+        return len(self.queues.get(user_id, ()))
+
+    def metrics(self):
+        return {
+            "active_users": len(self.queues),
+            "waiting": sum(len(queue) - 1 for queue in self.queues.values()),
+        }
+
+class ExecutionSlots:
+    """Caps how many executions run at once over all users. At most max_waiting requests
+    wait for a slot, anything beyond that is turned away right away with a retry hint
+    based on how long executions recently took.
+
+    Waiting requests are served in weighted fair order (start-time fair queueing): each
+    request is tagged with the virtual time at which its user has used up their earlier
+    executions, estimated from how long that user's executions take. Users who ran little
+    recently are served first, heavy users wait behind them.
+    Only used from the sandbox service event loop, so it needs no locking."""
+
+    def __init__(self, limit=4, max_waiting=32, max_wait=60):
+        self.limit = limit
+        self.max_waiting = max_waiting
+        self.max_wait = max_wait
+        self.running = 0
+        self.waiters = []           # heap of [start tag, arrival number, future]
+        self.arrivals = 0
+        self.virtual_time = 0.0     # start tag of the request that got a slot last
+        self.finish_tags = {}       # user_id -> virtual time at which their executions are paid for
+        self.durations = {}         # user_id -> moving average of their execution times (seconds)
+        self.average_duration = 1.0 # moving average of how long a slot is held (seconds)
+        self.rejected = 0
+
+    def retry_after(self):
+        """Estimated seconds until a new request would get a slot"""
+        ahead = len(self.waiters) + 1
+        return max(1, math.ceil(self.average_duration * ahead / max(1, self.limit)))
+
+    def full(self):
+        return self.running >= self.limit and len(self.waiters) >= self.max_waiting
+
+    def _tag(self, user_id, weight):
+        start = max(self.virtual_time, self.finish_tags.get(user_id, 0.0))
+        cost = self.durations.get(user_id, self.average_duration)
+        self.finish_tags[user_id] = start + cost / weight
+        return start
+
+    @asynccontextmanager
+    async def slot(self, user_id=None, weight=1, timeout=None):
+        """Wait (at most timeout seconds) for one of the execution slots"""
+        timeout = self.max_wait if timeout is None else timeout
+        if self.running < self.limit and not self.waiters:
+            self.running += 1
+            self.virtual_time = self._tag(user_id, weight)
+        elif len(self.waiters) >= self.max_waiting:
+            self.rejected += 1
+            raise QueueBusy("Server is busy", len(self.waiters), self.retry_after())
+        else:
+            ticket = asyncio.get_running_loop().create_future()
+            self.arrivals += 1
+            waiter = [self._tag(user_id, weight), self.arrivals, ticket]
+            heapq.heappush(self.waiters, waiter)
+            try:
+                # The releasing request hands its slot over, running stays the same
+                await asyncio.wait_for(asyncio.shield(ticket), timeout)
+            except asyncio.TimeoutError:
+                if not ticket.done():
+                    position = sum(other < waiter for other in self.waiters)
+                    self._remove(waiter)
+                    self.rejected += 1
+                    raise QueueBusy("Timed out waiting for a free execution slot", position, self.retry_after())
+            except BaseException:
+                if not ticket.done():
+                    self._remove(waiter)
+                else:
+                    self._release()     # the slot was already handed to us
+                raise
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            duration = time.monotonic() - started
+            self.average_duration += 0.2 * (duration - self.average_duration)
+            if user_id is not None:
+                previous = self.durations.get(user_id, duration)
+                self.durations[user_id] = previous + 0.5 * (duration - previous)
+            self._release()
+
+    def _remove(self, waiter):
+        self.waiters.remove(waiter)
+        heapq.heapify(self.waiters)
+
+    def _release(self):
+        if self.waiters:
+            start, _, ticket = heapq.heappop(self.waiters)
+            self.virtual_time = start
+            ticket.set_result(None)
+        else:
+            self.running -= 1
+        # Users whose executions are paid for by now have no history worth keeping
+        for user_id in [user_id for user_id, tag in self.finish_tags.items() if tag <= self.virtual_time]:
+            del self.finish_tags[user_id]
+            self.durations.pop(user_id, None)
+
+    def metrics(self):
+        return {
+            "limit": self.limit,
+            "running": self.running,
+            "waiting": len(self.waiters),
+            "rejected": self.rejected,
+            "retry_after": self.retry_after(),
+        }
+
+class RateLimiter:
+    """Token bucket per user: every request takes a token, tokens refill at rate per
+    second up to burst. Used from the request threads, so it is guarded by a lock.
+    With a store (see registry.py) the buckets are shared by all worker processes."""
+
+    def __init__(self, rate=0.5, burst=10, store=None):
+        self.rate = rate
+        self.burst = burst
+        self.store = store
+        self.buckets = {}   # user_id -> (tokens, time of last update)
+        self.limited = 0
+        self.lock = threading.Lock()
+
+    def take(self, user_id, cost=1):
+        """Takes cost tokens from the bucket of user_id. Returns 0 if that was possible,
+        otherwise the number of seconds after which it will be."""
+        if self.store is not None:
+            retry_after = self.store.take_tokens(user_id, cost, self.rate, self.burst)
+            if retry_after:
+                with self.lock:
+                    self.limited += 1
+            return retry_after
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated = self.buckets.get(user_id, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens < cost:
+                self.buckets[user_id] = (tokens, now)
+                self.limited += 1
+                return max(1, math.ceil((cost - tokens) / self.rate))
+            self.buckets[user_id] = (tokens - cost, now)
+            if len(self.buckets) > 1024:
+                self._prune(now)
+            return 0
+
+    def _prune(self, now):
+        # A full bucket is the same as no bucket
+        for user_id, (tokens, updated) in list(self.buckets.items()):
+            if tokens + (now - updated) * self.rate >= self.burst:
+                del self.buckets[user_id]
+
+    def metrics(self):
+        users = self.store.rate_bucket_count() if self.store is not None else None
+        with self.lock:
+            return {"rate": self.rate, "burst": self.burst, "limited": self.limited,
+                    "users": len(self.buckets) if users is None else users}
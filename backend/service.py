@@ -0,0 +1,60 @@
+import asyncio
+import functools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+class SandboxService:
+    """Event loop thread that sandbox operations are queued on.
+
+    Waiting for executions happens asynchronously on the loop, so any number of them can be
+    in flight without holding a thread each. The short blocking Docker SDK calls run on a
+    small bounded thread pool instead of on the request threads.
+    """
+
+    def __init__(self, max_workers=16):
+        self.loop = asyncio.new_event_loop()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="docker")
+        self.loop.set_default_executor(self.executor)
+        self.in_flight = 0
+        self.completed = 0
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True, name="sandbox-service")
+        self.thread.start()
+
+    def submit(self, coroutine):
+        """Queue a coroutine on the loop, returns a concurrent.futures.Future"""
+        with self.lock:
+            self.in_flight += 1
+        future = asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future):
+        with self.lock:
+            self.in_flight -= 1
+            self.completed += 1
+
+    def call(self, coroutine, timeout=None):
+        """Queue a coroutine and wait for its result from a (request) thread"""
+        return self.submit(coroutine).result(timeout)
+
+    async def blocking(self, function, *args, **kwargs):
+        """Await a blocking function that runs on the Docker thread pool"""
+        return await self.loop.run_in_executor(None, functools.partial(function, *args, **kwargs))
+
+    def run(self, function, *args, **kwargs):
+        """Run a blocking function on the Docker thread pool and wait for its result"""
+        return self.call(self.blocking(function, *args, **kwargs))
+
+    def on_loop(self, function, *args):
+        """Run a quick function on the loop thread, for state that only the loop touches"""
+        async def wrapper():
+            return function(*args)
+        return asyncio.run_coroutine_threadsafe(wrapper(), self.loop).result()
+
+    def metrics(self):
+        with self.lock:
+            return {"in_flight": self.in_flight, "completed": self.completed}
@@ -0,0 +1,6 @@
+import os
+import tempfile
+
+# Tests must not start pool containers or write to the registry of the server
+os.environ["SANDBOX_POOL_SIZES"] = "latest=0,nightly=0,experimental=0"
+os.environ["SANDBOX_REGISTRY_PATH"] = os.path.join(tempfile.mkdtemp(prefix="stormvogel-tests-"), "sandboxes.sqlite3")
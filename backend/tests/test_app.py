@@ -1,3 +1,4 @@
+import json
 import pytest
 import os
 import time
@@ -9,7 +10,19 @@ from sandbox import (
     stop_sandbox,
     lint_code,
     execute_code,
+    metrics,
+    helper_versions,
+    HELPERS_DIGEST,
+    container_manager,
+    OutputCollector,
+    _store_results,
+    _artifacts_available,
+    read_artifact,
 )
+import sandbox
+from registry import SharedRegistry
+from result_cache import ResultCache
+from records import RECORD_HEADER, Record, parse_records
 
 client = docker.from_env()
 USER_ID = "test-real-user"
@@ -23,6 +36,11 @@ def wait_for_container_ready(container, timeout=5):
         time.sleep(1)
     return False
 
+@pytest.fixture(scope="module", autouse=True)
+def background():
+    # Registry sync and reaper, the pool is empty in the tests (see conftest.py)
+    sandbox.start_background()
+
 @pytest.fixture(scope="module")
 def real_container():
     container = start_sandbox(USER_ID)
@@ -31,15 +49,22 @@ def real_container():
     yield container
     stop_sandbox(USER_ID)
 
-def test_lint_code_success(real_container):
+def test_lint_code_success():
     result = lint_code(USER_ID, "x = 1\n")
     assert result["status"] == "success"
-    assert "script.py" not in result["lint_output"]  # no issues expected
+    assert result["diagnostics"] == []  # no issues expected
 
-def test_lint_code_failure(real_container):
-    result = lint_code(USER_ID, "x==1\n")  # should trigger linter
-    assert result["status"] == "error"
-    assert "script.py" in result["message"]
+def test_lint_code_failure():
+    result = lint_code(USER_ID, "import os\nx==1\n")  # should trigger linter
+    assert result["status"] == "success"
+    unused_import = next(d for d in result["diagnostics"] if d["code"] == "F401")
+    assert (unused_import["line"], unused_import["column"], unused_import["end_column"]) == (1, 8, 10)
+
+def test_lint_results_are_remembered():
+    before = metrics()["lint"]["hits"]
+    first = lint_code(USER_ID, "import os\n")
+    assert lint_code(USER_ID, "import os\n") == first
+    assert metrics()["lint"]["hits"] == before + 1
 
 def test_execute_code_success(real_container):
     result = execute_code(USER_ID, "print('Hello from real test')")
@@ -55,3 +80,221 @@ def test_execute_code_crash(real_container):
     result = execute_code(USER_ID, "1/0")
     assert result["status"] == "error"
     assert  "Execution failed" in result["message"]
+
+def test_metrics_report_pool(real_container):
+    pool = metrics()["pool"]
+    assert set(pool) == {"latest", "nightly", "experimental"}
+    assert all("idle" in stats and "hits" in stats for stats in pool.values())
+
+def test_execute_code_resets_instead_of_restarting(real_container):
+    before = metrics()["recycling"].get("reset", 0)
+    result = execute_code(USER_ID, "open('/tmp/leftover', 'w').write('x')")
+    assert result["status"] == "success"
+    assert metrics()["recycling"].get("reset", 0) == before + 1
+    assert real_container.exec_run(["test", "-e", "/tmp/leftover"]).exit_code != 0
+
+def test_execute_code_streams_output(real_container):
+    streamed = []
+    result = execute_code(USER_ID, "print('first')\nprint('second')", on_output=streamed.append)
+    assert result["status"] == "success"
+    assert "".join(streamed) == "first\nsecond\n"
+
+def test_outdated_helpers_are_reinstalled(real_container):
+    real_container.exec_run(["sh", "-c", "echo outdated > /helpers.sha256"])
+    helper_versions.pop(real_container.id, None)
+    result = execute_code(USER_ID, "import playground\nprint('helpers ok')")
+    assert result["status"] == "success"
+    assert real_container.exec_run(["cat", "/helpers.sha256"]).output.decode().strip() == HELPERS_DIGEST
+
+def test_execute_code_uploads_tabs(real_container):
+    result = execute_code(USER_ID, "print(open('model.pm').read())", tabs={"model.pm": "dtmc"})
+    assert result["status"] == "success"
+    assert "dtmc" in result["output_non_html"]
+
+def test_removed_tabs_are_uploaded_again(real_container):
+    tabs = {"model.pm": "dtmc"}
+    assert execute_code(USER_ID, "import os\nos.remove('model.pm')", tabs=tabs)["status"] == "success"
+    result = execute_code(USER_ID, "print(open('model.pm').read())", tabs=tabs)
+    assert result["status"] == "success"
+    assert "dtmc" in result["output_non_html"]
+
+def test_registry_tracks_sandbox(real_container):
+    entry = container_manager.lookup(USER_ID)
+    assert entry["container_id"] == real_container.id
+    assert entry["tag"] == "nightly" and entry["state"] == "running"
+    assert container_manager.get_container(USER_ID).id == real_container.id
+
+def test_idle_sandboxes_are_reaped_at_deadline():
+    user_id = "reaper_test"
+    container_manager.register_container(user_id, type("Container", (), {"id": "reaper_test_id"})(), "latest")
+    before = container_manager.lookup(user_id)["last_used"]
+    time.sleep(0.01)
+    container_manager.touch(user_id)
+    assert container_manager.lookup(user_id)["last_used"] > before
+
+    # Pretend the sandbox reached its max lifetime, the reaper removes it without polling
+    with container_manager.store.transaction() as db:
+        db.execute("UPDATE sandboxes SET created = created - ?, deadline = 0 WHERE user_id = ?",
+                   (container_manager.max_lifetime, user_id))
+    container_manager._deadline_changed()
+    for _ in range(50):
+        if container_manager.lookup(user_id) is None:
+            break
+        time.sleep(0.1)
+    assert container_manager.lookup(user_id) is None
+
+def test_result_cache_only_keeps_results_of_clean_sandboxes(tmp_path, monkeypatch):
+    store = SharedRegistry(str(tmp_path / "registry.sqlite3"), 60, 600)
+    for user_id in ("used_user", "fresh_user"):
+        store.put(user_id, f"{user_id}_container", f"sandbox_{user_id}", "latest", "running")
+    store.mark_clean("fresh_user_container")
+
+    async def cache_key(user_id, code, tabs):
+        return code
+
+    async def execute(user_id, code, tabs=None, on_output=None):
+        return {"status": "success", "output_non_html": user_id}
+
+    monkeypatch.setattr(sandbox.container_manager, "store", store)
+    monkeypatch.setattr(sandbox, "result_cache", ResultCache(max_bytes=1 << 20))
+    monkeypatch.setattr(sandbox, "_result_cache_key", cache_key)
+    monkeypatch.setattr(sandbox, "_execute_code", execute)
+    run = lambda user_id: sandbox.service.call(sandbox.execute_code_async(user_id, "print(1)"))
+
+    # The used sandbox may have been changed by its user, its result is not shared
+    assert "cached" not in run("used_user")
+    assert "cached" not in run("fresh_user")
+    assert run("used_user") == {"status": "success", "output_non_html": "fresh_user", "cached": True}
+    assert not store.take_clean("fresh_user_container")
+
+def test_new_sandboxes_reserve_their_place_first(tmp_path, monkeypatch):
+    store = SharedRegistry(str(tmp_path / "registry.sqlite3"), 60, 600)
+    store.put("other_user", "other_container", "sandbox_other_user", "latest", "running")
+    monkeypatch.setattr(sandbox.container_manager, "store", store)
+    monkeypatch.setattr(sandbox.sandbox_pool, "store", store)
+    monkeypatch.setattr(sandbox, "MAX_SANDBOXES", 2)
+
+    def run_container(tag, name, labels=None):
+        # The place is taken before the container is created
+        assert store.get("new_user")["state"] == "starting"
+        raise docker.errors.APIError("no room")
+
+    monkeypatch.setattr(sandbox, "run_container", run_container)
+    with pytest.raises(docker.errors.APIError):
+        start_sandbox("new_user", "latest")
+    # A failed startup gives its place back, a full host turns the next one away
+    assert store.get("new_user") is None
+    store.put("third_user", "third_container", "sandbox_third_user", "latest", "running")
+    with pytest.raises(sandbox.QueueBusy):
+        start_sandbox("new_user", "latest")
+
+def test_large_output_is_spilled_to_file(tmp_path):
+    streamed = []
+    spill_path = str(tmp_path / "output.log")
+    collector = OutputCollector(streamed.append, max_output=100, max_inline=30, spill_path=spill_path)
+    collector.feed(b"first line\n<!DOCTYPE html>\n<p>cut off</p>\n")
+    collector.feed(b"x" * 100 + b"\n")
+    collector.close()
+    # Only complete output stays in memory, the partial HTML document is dropped
+    assert collector.output() == "first line\n"
+    assert streamed == ["first line\n"]
+    assert collector.truncated and collector.spilled() and not collector.complete
+    with open(spill_path, "rb") as f:
+        assert f.read() == b"first line\n<!DOCTYPE html>\n<p>cut off</p>\n"
+
+def test_unfinished_html_document_is_kept_as_output():
+    streamed = []
+    collector = OutputCollector(streamed.append, max_output=100, max_inline=50)
+    collector.feed(b"hi\n<!DOCTYPE html>\nbye\n")
+    collector.close()
+    assert collector.output() == "hi\n<!DOCTYPE html>\nbye\n"
+    assert streamed == ["hi\n", "<!DOCTYPE html>\n", "bye\n"]
+    assert not collector.truncated
+
+def test_spilled_output_is_written_frame_by_frame(tmp_path):
+    spill_path = str(tmp_path / "output.log")
+    collector = OutputCollector(max_output=60, max_inline=10, spill_path=spill_path)
+    collector.feed(b"short\n" + b"y" * 10 + b"\n")
+    collector.feed(b"z" * 20)
+    # Past max_output everything is dropped, also frames that would still fit
+    collector.feed(b"w" * 30)
+    collector.feed(b"v")
+    collector.close()
+    assert collector.output() == "short\n"
+    assert collector.size == 37 and not collector.complete
+    with open(spill_path, "rb") as f:
+        assert f.read() == b"short\n" + b"y" * 10 + b"\n" + b"z" * 20
+
+def test_show_records_become_artifacts(tmp_path, monkeypatch):
+    monkeypatch.setattr(sandbox, "ARTIFACT_DIR", str(tmp_path))
+    def record(description, payload):
+        description = json.dumps(description).encode()
+        return RECORD_HEADER.pack(len(description), len(payload)) + description + payload
+    data = (record({"type": "html", "mime": "text/html"}, b"<!DOCTYPE html><html>model</html>")
+            + record({"type": "image", "mime": "image/png", "name": "plot.png"}, b"\x89PNG")
+            + record({"type": "html", "mime": "text/html"}, b"<!DOCTYPE html><html>model</html>")
+            + record({"type": "text", "mime": "text/plain"}, b"summary")
+            + record({"type": "metadata", "mime": "application/json"}, b'{"states": 5}'))
+    # A record cut off by a killed script is dropped
+    records = parse_records(data + record({"type": "html", "mime": "text/html"}, b"<html>")[:-3])
+    artifacts, texts, metadata = _store_results(records)
+    # The result only lists the artifacts, identical ones are stored once
+    assert [(a["type"], a["mime"], a["size"]) for a in artifacts] == [
+        ("html", "text/html", 33), ("image", "image/png", 4), ("html", "text/html", 33)]
+    assert artifacts[0]["id"] == artifacts[2]["id"] and artifacts[1]["name"] == "plot.png"
+    assert len(os.listdir(tmp_path)) == 2
+    assert read_artifact(artifacts[1]["id"]) == b"\x89PNG"
+    assert texts == ["summary"]
+    assert metadata == [{"states": 5}]
+    assert _artifacts_available(artifacts)
+    os.remove(tmp_path / artifacts[1]["id"])
+    assert not _artifacts_available(artifacts)
+
+def test_printed_html_becomes_a_record():
+    record, output = sandbox._printed_html("before\n<!DOCTYPE html><html>model</html>\nafter")
+    assert record.type == "html" and record.payload == b"<!DOCTYPE html><html>model</html>"
+    assert output == "before\n\nafter"
+    # A document without its closing tag is plain output
+    collector = OutputCollector()
+    collector.feed(b"<!DOCTYPE html>\n<p>no end</p>\n")
+    collector.close()
+    assert collector.html_start is not None
+    assert sandbox._printed_html(collector.output()) == (None, "<!DOCTYPE html>\n<p>no end</p>")
+
+def test_artifacts_are_served_as_binary_with_etag(tmp_path, monkeypatch):
+    import app
+    monkeypatch.setattr(sandbox, "ARTIFACT_DIR", str(tmp_path))
+    monkeypatch.setattr(app.app, "secret_key", "test")
+    png, = _store_results([Record({"type": "image", "mime": "image/png"}, b"\x89PNG\r\n")])[0]
+    svg, = _store_results([Record({"type": "image", "mime": "image/svg+xml"}, b"<svg/>")])[0]
+    http = app.app.test_client()
+    with http.session_transaction() as session:
+        session["user_id"] = USER_ID
+    response = http.get(f"/api/artifacts/{png['id']}")
+    assert response.mimetype == "image/png" and response.data == b"\x89PNG\r\n"
+    assert response.headers["ETag"] == f'"{png["id"].split(".")[0]}"'
+    assert http.get(f"/api/artifacts/{png['id']}", headers={"If-None-Match": response.headers["ETag"]}).status_code == 304
+    # SVG may contain scripts, it must not run in the origin of the playground
+    response = http.get(f"/api/artifacts/{svg['id']}")
+    assert response.mimetype == "image/svg+xml" and response.headers["Content-Security-Policy"] == "sandbox"
+
+def test_metrics_require_the_admin_token(monkeypatch):
+    import app
+    http = app.app.test_client()
+    monkeypatch.delenv("ADMIN_TOKEN", raising=False)
+    assert http.get("/api/metrics", headers={"X-Admin-Token": ""}).status_code == 403
+    monkeypatch.setenv("ADMIN_TOKEN", "secret")
+    assert http.get("/api/metrics").status_code == 403
+    assert http.get("/api/admin/scheduler", headers={"X-Admin-Token": "wrong"}).status_code == 403
+    response = http.get("/api/metrics", headers={"X-Admin-Token": "secret"})
+    assert response.status_code == 200 and "execution_slots" in response.json
+
+def test_exit_code_waits_until_exec_stopped(monkeypatch):
+    # The output socket can close before Docker has recorded the exit of the exec
+    inspections = iter([{"Running": True, "ExitCode": None}, {"Running": False, "ExitCode": None},
+                        {"Running": False, "ExitCode": 0}])
+    monkeypatch.setattr(sandbox.client.api, "exec_inspect", lambda exec_id: next(inspections))
+    assert sandbox.service.call(sandbox._exit_code("exec")) == 0
+    monkeypatch.setattr(sandbox.client.api, "exec_inspect", lambda exec_id: {"Running": True, "ExitCode": None})
+    assert sandbox.service.call(sandbox._exit_code("exec", timeout=0.1)) is None
+    assert sandbox._fault_for_exit_code(None) == "crash"
@@ -0,0 +1,35 @@
+import os
+import sys
+import time
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from jobs import JobStore
+from registry import SharedRegistry
+from service import SandboxService
+
+USER_ID = "test-user"
+
+def test_job_store_is_polled_with_a_cursor(tmp_path):
+    path = str(tmp_path / "registry.sqlite3")
+    store = JobStore(SandboxService(max_workers=1), SharedRegistry(path, 60, 600), flush_interval=0.01)
+    # Another worker process polls the same registry
+    other = JobStore(SandboxService(max_workers=1), SharedRegistry(path, 60, 600))
+    async def run(code, on_output):
+        on_output("partial\n")
+        return {"status": "success", "output_non_html": code}
+    job_id = store.submit(USER_ID, run, "done")
+    events, since = [], 0
+    for _ in range(100):
+        polled = other.poll(job_id, USER_ID, since)
+        events += polled["events"]
+        since = polled["next"]
+        if polled["state"] == "done":
+            break
+        time.sleep(0.01)
+    assert polled["result"] == {"status": "success", "output_non_html": "done"}
+    assert {"event": "output", "data": {"text": "partial\n"}} in events
+    assert events[-2:] == [{"event": "result", "data": polled["result"]}, {"event": "state", "data": {"state": "done"}}]
+    # Every event is returned once, a poll with the last cursor has nothing new
+    assert [event["event"] for event in events].count("output") == 1 and other.poll(job_id, USER_ID, since)["events"] == []
+    assert "events" not in store.poll(job_id, USER_ID)
+    assert other.poll(job_id, "someone-else") is None
+    assert other.metrics()["done"] == 1
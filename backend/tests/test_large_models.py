@@ -0,0 +1,21 @@
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "resources")))
+import large_models
+
+def test_large_models_are_summarized():
+    # A chain of 3000 states, each moving to the next one or back to the start
+    successors = lambda state: [("", 0.5, (state + 1) % 3000), ("", 0.5, 0)]
+    graph = large_models.ModelGraph("DTMC", 3000, 6000, [0], successors, lambda state: [str(state % 2)],
+                                    {"0": 1500, "1": 1500}, value=lambda state: state / 3000,
+                                    statistics=large_models.value_statistics(state / 3000 for state in range(3000)))
+    assert large_models.is_large(graph.num_states, graph.num_transitions)
+    assert large_models.neighbourhood(successors, [0], 5) == [0, 1, 2, 3, 4]
+    nodes, edges = large_models.subgraph(graph, [0, 1, 2])
+    # Only transitions inside the subgraph are drawn, the border of the subgraph is dashed
+    assert len(edges) == 5 and "shapeProperties" in nodes[2] and "shapeProperties" not in nodes[0]
+    summary = large_models.summary(graph)
+    assert summary["labels"] == {"0": 1500, "1": 1500}
+    assert summary["result"]["count"] == 3000 and summary["result"]["max"] == 2999 / 3000
+    document = large_models.render(graph, max_states=50)
+    assert "3,000" in document and document.count('"arrows"') < 100
@@ -0,0 +1,18 @@
+import asyncio
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from linter import Linter
+
+USER_ID = "test-user"
+
+def test_lint_supersedes_older_request_of_session():
+    async def scenario():
+        linter = Linter(coalesce_delay=0.2)
+        older = asyncio.create_task(linter.lint_latest(USER_ID, "import os\n"))
+        await asyncio.sleep(0)
+        newer = await linter.lint_latest(USER_ID, "import sys\n")
+        assert (await older)["status"] == "superseded"
+        assert "`sys` imported but unused" in [d["message"] for d in newer["diagnostics"]]
+        assert linter.metrics()["misses"] == 1
+    asyncio.run(scenario())
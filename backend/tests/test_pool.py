@@ -0,0 +1,8 @@
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from pool import parse_pool_sizes
+
+def test_parse_pool_sizes():
+    sizes = parse_pool_sizes("latest=3, nightly=x,unknown=2", ("latest", "nightly", "experimental"))
+    assert sizes == {"latest": 3, "nightly": 0, "experimental": 0}
@@ -0,0 +1,21 @@
+import json
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from records import RECORD_HEADER, parse_records
+
+def record(description, payload):
+    description = json.dumps(description).encode()
+    return RECORD_HEADER.pack(len(description), len(payload)) + description + payload
+
+def test_records_are_parsed_by_their_sizes():
+    data = (record({"type": "image", "mime": "image/png", "name": "plot.png"}, b"\x89PNG\n\x00")
+            + record({"type": "unknown"}, b"skipped")
+            + record({"type": "text", "mime": "text/plain"}, "Zustände".encode()))
+    records = parse_records(data)
+    assert [(r.type, r.mime, r.payload) for r in records] == [
+        ("image", "image/png", b"\x89PNG\n\x00"), ("text", "text/plain", "Zustände".encode())]
+    assert records[0].description["name"] == "plot.png" and records[1].text() == "Zustände"
+    # A record cut off by a killed script is dropped, the ones before it are kept
+    assert len(parse_records(data + record({"type": "html", "mime": "text/html"}, b"<html>")[:-3])) == 2
+    assert parse_records(b"") == []
@@ -0,0 +1,81 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from registry import SharedRegistry
+
+def test_shared_registry_claims_expired_sandbox_once(tmp_path):
+    path = str(tmp_path / "registry.sqlite3")
+    first, second = SharedRegistry(path, 60, 600), SharedRegistry(path, 60, 600)
+    first.put("shared_user", "container_id", "sandbox_shared_user", "latest", "running")
+    second.record_uploads("container_id", {"script.py": "digest"})
+    assert second.get("shared_user")["container_id"] == "container_id"
+    assert first.uploads("container_id") == {"script.py": "digest"}
+
+    # Both workers see the expired sandbox, only one of them gets to remove it
+    later = time.time() + 120
+    assert first.claim_expired(later)["user_id"] == "shared_user"
+    assert second.claim_expired(later) is None
+
+def test_shared_registry_limits_executions_over_workers(tmp_path):
+    path = str(tmp_path / "registry.sqlite3")
+    first, second = SharedRegistry(path, 60, 600), SharedRegistry(path, 60, 600)
+    assert first.acquire_execution_slot("a", 2, 60)
+    assert second.acquire_execution_slot("b", 2, 60)
+    assert not first.acquire_execution_slot("c", 2, 60)
+    second.release_execution_slot("b")
+    assert first.acquire_execution_slot("c", 2, 60)
+    # Slots of a worker that died are freed after stale_after seconds
+    assert second.acquire_execution_slot("d", 2, 0)
+    assert first.running_executions() == 1
+
+def test_shared_registry_keeps_one_turn_per_user(tmp_path):
+    path = str(tmp_path / "registry.sqlite3")
+    first, second = SharedRegistry(path, 60, 600), SharedRegistry(path, 60, 600)
+    assert first.acquire_turn("shared_user", "a", 60)
+    assert not second.acquire_turn("shared_user", "b", 60)
+    assert second.acquire_turn("other_user", "c", 60)
+    first.release_turn("shared_user", "a")
+    assert second.acquire_turn("shared_user", "b", 60)
+    # A turn of a worker that died is freed after stale_after seconds
+    assert first.acquire_turn("shared_user", "d", 0)
+
+def test_shared_registry_rate_buckets(tmp_path):
+    path = str(tmp_path / "registry.sqlite3")
+    first, second = SharedRegistry(path, 60, 600), SharedRegistry(path, 60, 600)
+    assert first.take_tokens("shared_user", 1, 0.01, 2) == 0
+    assert second.take_tokens("shared_user", 1, 0.01, 2) == 0
+    assert first.take_tokens("shared_user", 1, 0.01, 2) >= 1
+    assert second.rate_bucket_count() == 1
+
+def test_shared_registry_hands_out_pool_containers_once(tmp_path):
+    path = str(tmp_path / "registry.sqlite3")
+    first, second = SharedRegistry(path, 60, 600), SharedRegistry(path, 60, 600)
+    assert first.reserve_pool_container("token", "latest", 1, 2, 60)
+    assert not second.reserve_pool_container("other", "latest", 1, 2, 60)
+    assert first.pool_container_ready("token", "container_id")
+    assert second.pool_counts() == {"latest": 1}
+    assert second.take_pool_container("latest", "shared_user", "sandbox_shared_user") == "container_id"
+    assert first.take_pool_container("latest", "other_user", "sandbox_other_user") is None
+    # The handed out container counts as a sandbox, so the limit leaves no room for a refill
+    assert second.get("shared_user")["state"] == "starting"
+    assert second.reserve_pool_container("other", "latest", 1, 2, 60)
+    assert not first.reserve_pool_container("third", "nightly", 1, 2, 60)
+
+def test_shared_registry_reserves_sandboxes_up_to_the_limit(tmp_path):
+    path = str(tmp_path / "registry.sqlite3")
+    SharedRegistry(path, 60, 600).add_pool_container("pool_container", "nightly")
+    # Eight concurrent startups, the idle pool container takes one of the three places
+    def reserve(index):
+        registry = SharedRegistry(path, 60, 600)
+        return registry.reserve_sandbox(f"user_{index}", f"token_{index}", f"sandbox_user_{index}", "latest", 3, 60)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        reserved = list(executor.map(reserve, range(8)))
+    assert reserved.count(True) == 2
+    registry = SharedRegistry(path, 60, 600)
+    assert registry.counts() == {"starting": 2}
+    # A failed startup gives its place back
+    user = f"user_{reserved.index(True)}"
+    registry.release_sandbox(user, registry.get(user)["container_id"])
+    assert registry.reserve_sandbox("late_user", "late_token", "sandbox_late_user", "latest", 3, 60)
@@ -0,0 +1,17 @@
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from result_cache import ResultCache, result_key
+
+def test_result_cache_evicts_least_recently_used():
+    first, second, third = (result_key("sha256:image", f"print({n})", {"model.pm": "dtmc"}) for n in range(3))
+    assert result_key("sha256:image", "print(0)", {"model.pm": "mdp"}) != first
+    result = {"status": "success", "output_html": "", "output_non_html": "x" * 100}
+    cache = ResultCache(max_bytes=400)
+    cache.put(first, result)
+    cache.put(second, result)
+    assert cache.get(first) == result
+    cache.put(third, result)
+    assert cache.get(second) is None
+    assert cache.get(first) == result and cache.get(third) == result
+    assert cache.metrics()["bytes"] <= 400
@@ -0,0 +1,74 @@
+import asyncio
+import pytest
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from registry import SharedRegistry
+from scheduler import ExecutionQueue, ExecutionSlots, QueueBusy, RateLimiter
+
+USER_ID = "test-user"
+
+def test_execution_queue_bounds_waiting():
+    async def scenario():
+        queue = ExecutionQueue(max_wait=0.1, max_length=2)
+        async with queue.turn(USER_ID):
+            assert queue.position(USER_ID) == 1
+            with pytest.raises(QueueBusy) as busy:
+                async with queue.turn(USER_ID):
+                    pass
+            assert busy.value.position == 1
+        assert queue.position(USER_ID) == 0
+    asyncio.run(scenario())
+
+def test_execution_slots_turn_away_overflow():
+    async def scenario():
+        slots = ExecutionSlots(limit=1, max_waiting=1, max_wait=1)
+        order = []
+        async def waiter():
+            async with slots.slot():
+                order.append("waiter")
+        async with slots.slot():
+            task = asyncio.create_task(waiter())
+            await asyncio.sleep(0)
+            assert slots.full()
+            with pytest.raises(QueueBusy) as busy:
+                async with slots.slot():
+                    pass
+            assert busy.value.retry_after >= 1
+            order.append("first")
+        await task
+        assert order == ["first", "waiter"]
+        assert slots.metrics()["running"] == 0 and slots.metrics()["rejected"] == 1
+    asyncio.run(scenario())
+
+def test_execution_slots_serve_light_users_first():
+    async def scenario():
+        slots = ExecutionSlots(limit=1, max_waiting=4, max_wait=1)
+        order = []
+        async def execute(user_id):
+            async with slots.slot(user_id):
+                order.append(user_id)
+        # The heavy user already used the server, so their next request waits for the light user
+        async with slots.slot("heavy"):
+            heavy = asyncio.create_task(execute("heavy"))
+            await asyncio.sleep(0)
+            light = asyncio.create_task(execute("light"))
+            await asyncio.sleep(0)
+        await asyncio.gather(heavy, light)
+        assert order == ["light", "heavy"]
+    asyncio.run(scenario())
+
+def test_rate_limiter_throttles_bursts():
+    limiter = RateLimiter(rate=1, burst=2)
+    assert limiter.take("heavy") == 0 and limiter.take("heavy") == 0
+    assert limiter.take("heavy") >= 1
+    assert limiter.take("light") == 0
+    assert limiter.metrics()["limited"] == 1
+
+def test_rate_limiter_shares_buckets_through_the_registry(tmp_path):
+    path = str(tmp_path / "registry.sqlite3")
+    first = RateLimiter(rate=0.01, burst=2, store=SharedRegistry(path, 60, 600))
+    second = RateLimiter(rate=0.01, burst=2, store=SharedRegistry(path, 60, 600))
+    assert first.take("heavy") == 0 and second.take("heavy") == 0
+    assert first.take("heavy") >= 1
+    assert second.metrics()["users"] == 1 and first.metrics()["limited"] == 1
@@ -0,0 +1,39 @@
+import numpy
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "resources")))
+import stormpy_models
+
+class _CheckResult:
+    def __init__(self, values=None, truth=None):
+        if values is not None:
+            self.get_values = lambda: values
+        if truth is not None:
+            self.get_truth_values = lambda: truth
+
+class _Model:
+    nr_states = 4
+
+def test_stormpy_results_are_vectorized():
+    values = stormpy_models.result_values(_Model(), _CheckResult(values=[0.5, float("nan"), 1.0, 0.25]))
+    assert values.dtype == float and numpy.isnan(values[1])
+    truth = stormpy_models.result_values(_Model(), _CheckResult(truth={0: True, 2: True, 1: False, 3: False}))
+    assert truth.tolist() == [1.0, 0.0, 1.0, 0.0]
+    # Parametric results have no numeric value per state
+    assert stormpy_models.result_values(_Model(), _CheckResult(values=["p", "1-p", "p", "0"])) is None
+    assert stormpy_models.result_values(_Model(), object()) is None
+
+    assert stormpy_models.array_statistics(values) == {"count": 3, "min": 0.25, "max": 1.0, "mean": 0.5833333333333334}
+    assert stormpy_models.array_statistics(numpy.array([float("nan")])) is None
+
+    # Highest first, states without a value come last, ties keep the order of the states
+    assert stormpy_models.top_states(values, 2) == [2, 0]
+    assert stormpy_models.top_states(values, 10) == [2, 0, 3, 1]
+    assert stormpy_models.top_states(numpy.array([1.0, 2.0, 2.0]), 2) == [1, 2]
+    assert stormpy_models.top_states(numpy.array([2.0, 3.0, 2.0, 2.0]), 2) == [1, 0]
+    # Also when more states tie at the cut than are returned
+    many = numpy.ones(1000)
+    many[::7] = 2.0
+    assert stormpy_models.top_states(many, 5) == [0, 7, 14, 21, 28]
+    assert stormpy_models.top_states(values, 2, candidates=[1, 3]) == [3, 1]
+    assert stormpy_models.top_states(values, 2, candidates=[]) == []
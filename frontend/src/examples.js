@@ -7,7 +7,33 @@ async function loadExample(category, title, files) {
         } catch (error) {
         }
     }
-    return { title, category: category, files: loadedFiles };
+    return { title, category: category, files: loadedFiles, paths: files };
+}
+
+async function sha256(text) {
+    const digest = await crypto.subtle.digest('SHA-256', new TextEncoder().encode(text));
+    return Array.from(new Uint8Array(digest), (byte) => byte.toString(16).padStart(2, '0')).join('');
+}
+
+// Output of an example precomputed for an image tag by backend/precompute_examples.py,
+// null if there is none or it was computed for a different version of the script or
+// with a different image than the sandbox runs (image is the id reported by /api/startup)
+export async function loadPrecomputedOutput(example, tag, image) {
+    const [filename, filePath] = Object.entries(example.paths)[0];
+    try {
+        const response = await fetch(`./examples/${filePath.replace(/\.py$/, '')}.${tag}.json.gz`);
+        if (!response.ok) {
+            return null;
+        }
+        const stream = response.body.pipeThrough(new DecompressionStream('gzip'));
+        const output = await new Response(stream).json();
+        if (!image || output.image !== image || output.source_sha256 !== await sha256(example.files[filename])) {
+            return null;
+        }
+        return { status: 'success', figures: output.figures, output_non_html: output.output_non_html };
+    } catch (error) {
+        return null;
+    }
 }
 
 // Create a manifest file that lists all examples
@@ -4,7 +4,7 @@
 export   function mapSeverity(errorCode) {
   if (errorCode == "E402")
     return "warning";
-  else if (errorCode.startsWith('E') || errorCode.startsWith('SyntaxError')) {
+  else if (errorCode.startsWith('E') || errorCode.startsWith('SyntaxError') || errorCode === 'invalid-syntax') {
     return "error";
   } else if (errorCode.startsWith('W')) {
     return "warning";
@@ -13,39 +13,28 @@ export   function mapSeverity(errorCode) {
   }
 }
 
-// Parses the lint output and extracts the line number, column number, error code, and message
-export function parseLintErrors(lintOutput, doc) {
-  const errors = [];
-  const lines = lintOutput.split('\n');
-  // Parses the output of the linter example: 
-  // /script.py:16:1: E402 Module level import not at top of file
-  const regex = /:(\d+):(\d+):\s(\w+)\s(.+)/;
-
-  // Parses the output of the linter for syntax errors, example:
-  // script.py:19:44: SyntaxError: Simple statements must be separated by newlines or semicolons
-  const syntaxErrorRegex = /:(\d+):(\d+):\s(SyntaxError):\s(.+)/;
-
-  for (const line of lines) {
-    let match = line.match(regex);
-    if (!match) {
-      match = line.match(syntaxErrorRegex);
+// Converts the diagnostics of the lint endpoint to editor ranges, example diagnostic:
+// { code: "E402", message: "Module level import not at top of file", line: 16, column: 1, end_line: 16, end_column: 12 }
+// Lines and columns are 1-based, the end column is exclusive
+export function parseLintDiagnostics(diagnostics, doc) {
+  return diagnostics.map(({ code, message, line, column, end_line, end_column }) => {
+    const startLine = doc.line(Math.min(line, doc.lines));
+    const endLine = doc.line(Math.min(end_line, doc.lines));
+    const from = Math.min(startLine.from + column - 1, startLine.to);
+    let to = Math.min(endLine.from + end_column - 1, endLine.to);
+    if (to <= from) {
+      to = startLine.to; // Empty range, mark till the end of the line
     }
-    if (match) {
-      const [, lineNum, colNum, errorCode, message] = match;
-      const lineNumInt = parseInt(lineNum);
-      const colNumInt = parseInt(colNum);
-      console.log(`Line: ${lineNumInt}, Column: ${colNumInt}, Error Code: ${errorCode}, Message: ${message}`);
-      const editorLine = doc.line(lineNumInt); // Get the line at lineNum
-      const from = editorLine.from + colNumInt - 1; // Adjust the starting position by subtracting 1 for zero-indexing
-      const to = editorLine.to; // Mark till the end of the line
+    return { from, to, severity: mapSeverity(code), message };
+  });
+}
 
-      errors.push({
-        from,
-        to,
-        severity: mapSeverity(errorCode),
-        message
-      });
-    }
+// The visualizations of a result, one per show() call of the script. Execution results list
+// artifacts that are only fetched when shown, precomputed outputs embed their documents.
+export function resultFigures(result) {
+  if (Array.isArray(result.artifacts)) {
+    return result.artifacts.map(({ id, type, name }) => ({ type, name, src: `/api/artifacts/${id}` }));
   }
-  return errors;
-}
\ No newline at end of file
+  const documents = Array.isArray(result.figures) ? result.figures : (result.output_html ? [result.output_html] : []);
+  return documents.map(srcdoc => ({ type: 'html', srcdoc }));
+}
@@ -1,6 +1,7 @@
 import { render, screen, fireEvent, waitFor } from '@testing-library/svelte';
 import Page from '../src/routes/+page.svelte';
-import { mapSeverity, parseLintErrors } from '../src/utils.js'; // Import functions
+import { mapSeverity, parseLintDiagnostics, resultFigures } from '../src/utils.js'; // Import functions
+import { loadPrecomputedOutput } from '../src/examples.js';
 import { vi } from 'vitest';
 
 
@@ -37,7 +38,10 @@ beforeEach(() => {
     } else if (url.endsWith('/api/lint')) {
       return Promise.resolve({
         json: () => Promise.resolve({
-          error: '/script.py:1:1: E001 Example error message'
+          status: 'success',
+          diagnostics: [
+            { code: 'E001', message: 'Example error message', line: 1, column: 1, end_line: 1, end_column: 6 }
+          ]
         }),
       });
     }
@@ -47,6 +51,7 @@ beforeEach(() => {
 
 afterEach(() => {
   vi.restoreAllMocks();
+  vi.unstubAllGlobals();
 });
 
 describe('Page Component', () => {
@@ -108,16 +113,24 @@ describe('Page Component', () => {
 
   test('executes code and displays output', async () => {
     // Mock fetch for this test
-    const mockFetch = vi.fn(() =>
-      Promise.resolve({
-        json: () => Promise.resolve({
-          status: 'success',
-          output_html: '',
-          output_non_html: 'Hello, World!',
-          message: null,
-        }),
-      })
-    );
+    const mockFetch = vi.fn((url) => {
+      if (url === '/api/jobs') {
+        return Promise.resolve({
+          json: () => Promise.resolve({ status: 'success', job_id: 'job1' }),
+        });
+      }
+      if (url.startsWith('/api/jobs/job1')) {
+        return Promise.resolve({
+          json: () => Promise.resolve({
+            status: 'success', state: 'done', events: [], next: 3,
+            result: { status: 'success', artifacts: [], output_non_html: 'Hello, World!' },
+          }),
+        });
+      }
+      return Promise.resolve({
+        json: () => Promise.resolve({ status: 'success', message: 'ok' }),
+      });
+    });
     vi.stubGlobal('fetch', mockFetch);
 
     render(Page);
@@ -137,20 +150,88 @@ describe('Page Component', () => {
       expect(screen.getByText('Hello, World!')).toBeInTheDocument();
     });
 
-    // Ensure fetch was called with the correct arguments
+    // Ensure fetch was called with the correct arguments, the tabs are sent along with the code
     expect(mockFetch).toHaveBeenCalledWith(
-      '/api/execute',
+      '/api/jobs',
       expect.objectContaining({
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ code: 'print("Hello, World!")' }),
       })
     );
+    const executeCall = mockFetch.mock.calls.find(([url]) => url === '/api/jobs');
+    const body = JSON.parse(executeCall[1].body);
+    expect(body.code).toBe('print("Hello, World!")');
+    expect(body.tabs['welcome.py']).toBe('print("Hello, World!")');
+    expect(mockFetch).not.toHaveBeenCalledWith('/api/save-tabs', expect.anything());
 
     // Restore the global fetch after the test
     vi.restoreAllMocks();
   });
 
+  test('polls job output while executing', async () => {
+    // The first poll returns a line of output, the second one the result
+    const polls = [
+      { status: 'success', state: 'running', events: [{ event: 'output', data: { text: 'Streamed line' } }], next: 2 },
+      { status: 'success', state: 'done', events: [], next: 4,
+        result: { status: 'success', artifacts: [], output_non_html: 'Final output' } },
+    ];
+    const mockFetch = vi.fn((url) => {
+      if (url === '/api/jobs') {
+        return Promise.resolve({
+          json: () => Promise.resolve({ status: 'success', job_id: 'job1' }),
+        });
+      }
+      if (url.startsWith('/api/jobs/job1')) {
+        return Promise.resolve({ json: () => Promise.resolve(polls.shift()) });
+      }
+      return Promise.resolve({
+        json: () => Promise.resolve({ status: 'success', message: 'ok' }),
+      });
+    });
+    vi.stubGlobal('fetch', mockFetch);
+
+    render(Page);
+    fireEvent.click(screen.getByText('▶ Run'));
+
+    await waitFor(() => {
+      expect(screen.getByText('Streamed line')).toBeInTheDocument();
+    });
+    await waitFor(() => {
+      expect(screen.getByText('Final output')).toBeInTheDocument();
+    });
+    // Each poll asks for the events after the ones it already has
+    const polled = mockFetch.mock.calls.map(([url]) => url).filter((url) => url.startsWith('/api/jobs/job1'));
+    expect(polled).toEqual(['/api/jobs/job1?since=0', '/api/jobs/job1?since=2']);
+  });
+
+  test('falls back to executing when an example has no precomputed output', async () => {
+    const mockFetch = vi.fn(() => Promise.resolve({ ok: false, status: 404 }));
+    vi.stubGlobal('fetch', mockFetch);
+    const example = { files: { 'bird.py': 'print(1)' }, paths: { 'bird.py': 'bird/bird.py' } };
+
+    expect(await loadPrecomputedOutput(example, 'nightly', 'sha256:image')).toBeNull();
+    expect(mockFetch).toHaveBeenCalledWith('./examples/bird/bird.nightly.json.gz');
+  });
+
+  test('ignores precomputed output of a different image', async () => {
+    const example = { files: { 'bird.py': 'print(1)' }, paths: { 'bird.py': 'bird/bird.py' } };
+    const digest = await crypto.subtle.digest('SHA-256', new TextEncoder().encode('print(1)'));
+    const output = {
+      source_sha256: Array.from(new Uint8Array(digest), (byte) => byte.toString(16).padStart(2, '0')).join(''),
+      image: 'sha256:old',
+      figures: [],
+      output_non_html: '1',
+    };
+    vi.stubGlobal('fetch', vi.fn(() => Promise.resolve({
+      ok: true,
+      body: new Response(JSON.stringify(output)).body.pipeThrough(new CompressionStream('gzip')),
+    })));
+
+    expect(await loadPrecomputedOutput(example, 'nightly', 'sha256:new')).toBeNull();
+    expect(await loadPrecomputedOutput(example, 'nightly', 'sha256:old'))
+      .toEqual({ status: 'success', figures: [], output_non_html: '1' });
+  });
+
   test('lints code and displays errors', async () => {
     render(Page);
     // Simulate entering code in the CodeMirror editor
@@ -169,37 +250,42 @@ describe('Page Component', () => {
     expect(mapSeverity('E001')).toBe('error');
     expect(mapSeverity('W001')).toBe('warning');
     expect(mapSeverity('I001')).toBe('info');
+    expect(mapSeverity('invalid-syntax')).toBe('error');
     expect(mapSeverity('unknown')).toBe('info');
   });
 
-  test('parseLintErrors function', () => {
-    const lintOutput = `
-      /path/to/file.py:1:1: E001 Example error message
-      /path/to/file.py:2:5: W001 Example warning message
-      /path/to/file.py:3:10: I001 Example info message
-    `;
-    const editor = {
-      state: {
-        doc: {
-          // Returns the start and end positions of a line given its line number
-          line: (lineNum) => ({ 
-            from: (lineNum - 1) * 20, // Start position of the line (0-based index)
-            to: lineNum * 20          // End position of the line
-          }),
-          // Returns the line number and start position given a character position
-          lineAt: (pos) => ({ 
-            number: Math.floor(pos / 20) + 1, // Line number (1-based index)
-            from: Math.floor(pos / 20) * 20   // Start position of the line
-          })
-        }
-      }
+  test('parseLintDiagnostics function', () => {
+    const diagnostics = [
+      { code: 'E001', message: 'Example error message', line: 1, column: 1, end_line: 1, end_column: 6 },
+      { code: 'W001', message: 'Example warning message', line: 2, column: 5, end_line: 2, end_column: 5 },
+      { code: 'invalid-syntax', message: 'Expected a statement', line: 3, column: 10, end_line: 4, end_column: 1 }
+    ];
+    const doc = {
+      lines: 3,
+      // Returns the start and end positions of a line given its line number
+      line: (lineNum) => ({
+        from: (lineNum - 1) * 20, // Start position of the line (0-based index)
+        to: lineNum * 20 - 1      // End position of the line
+      })
     };
-    
-    const errors = parseLintErrors(lintOutput, editor.state.doc);
-    expect(errors).toEqual([
-      { from: 0, to: 20, severity: 'error', message: 'Example error message' },
-      { from: 24, to: 40, severity: 'warning', message: 'Example warning message' },
-      { from: 49, to: 60, severity: 'info', message: 'Example info message' }
+
+    expect(parseLintDiagnostics(diagnostics, doc)).toEqual([
+      { from: 0, to: 5, severity: 'error', message: 'Example error message' },
+      { from: 24, to: 39, severity: 'warning', message: 'Example warning message' },
+      { from: 49, to: 59, severity: 'error', message: 'Expected a statement' }
     ]);
   });
+
+  test('resultFigures function', () => {
+    const id = 'a'.repeat(64);
+    expect(resultFigures({ artifacts: [{ id: `${id}.html`, type: 'html' }, { id: `${id}.png`, type: 'image', name: 'plot.png' }] }))
+      .toEqual([
+        { type: 'html', name: undefined, src: `/api/artifacts/${id}.html` },
+        { type: 'image', name: 'plot.png', src: `/api/artifacts/${id}.png` }
+      ]);
+    expect(resultFigures({ figures: ['<p>model</p>', '<p>plot</p>'] }))
+      .toEqual([{ type: 'html', srcdoc: '<p>model</p>' }, { type: 'html', srcdoc: '<p>plot</p>' }]);
+    expect(resultFigures({ output_html: '<p>model</p>' })).toEqual([{ type: 'html', srcdoc: '<p>model</p>' }]);
+    expect(resultFigures({ output_html: null })).toEqual([]);
+  });
 });
@@ -13,6 +13,9 @@ export default defineConfig({
             '/api/startup': 'http://127.0.0.1:5000',
             '/api/lint': 'http://127.0.0.1:5000',
             '/api/execute': 'http://127.0.0.1:5000',
+            '/api/jobs': 'http://127.0.0.1:5000',
+            '/api/outputs': 'http://127.0.0.1:5000',
+            '/api/artifacts': 'http://127.0.0.1:5000',
             '/api/stop': `http://127.0.0.1:5000`,
             '/api/save-tabs': `http://127.0.0.1:5000`,
         }